@@ -38,6 +38,7 @@ def init(f):
     globals.background = globals.screen.copy()
     globals.savefile_location = conf.get('lie','savefile_location')
     globals.wizard_mode = conf.getboolean('lie','wizard_mode')
+    globals.fov_processes = conf.getint('lie','fov_processes')
     #processing 'logging' section
     for name, level in conf.items('logging'):
         logging.getLogger(name).setLevel(logging.getLevelName(level))
@@ -3,14 +3,18 @@
 # Licensed under the Open Software License version 3.0.
 
 from numpy import array as ar
-from numpy import matrix
-from math import sqrt, pi, sin, cos
+from numpy import matrix, newaxis, where, argwhere, zeros, maximum, minimum, absolute, arange, repeat, cumsum, concatenate, flatnonzero, ones, int32
+from math import sqrt, pi, sin, cos, atan2, asin
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 import logging
 from exceptions import AssertionError
 
 SQRT3_4=sqrt(3.0/4)
+SECTOR_MARGIN=0.3 #extra angle, in radians, by which blocking loci are replicated into neighboring sectors
+HEX_NEIGHBORS=((1,0),(1,1),(0,1),(-1,0),(-1,-1),(0,-1))
 
-__all__=['RayPair', 'Locus','FOV']
+__all__=['RayPair', 'ExactRayPair', 'Locus', 'OffsetTable', 'Tracer', 'LoggingTracer', 'FOVStats', 'FOV']
 
 logger=logging.getLogger(__name__)
 
@@ -35,6 +39,41 @@ def _clockwiseCompare(p1, p2):
         return 0
     return 1
 
+def _clockwiseKey(p):
+    """Returns a key that sorts points in the same order as _clockwiseCompare."""
+    if p[0]>0:
+        return (0,-p[1])
+    return (1,p[1])
+
+def _angleBetween(a1, a2):
+    """Returns the absolute difference between two angles, in the range [0, pi]."""
+    d=abs(a1-a2)%(2*pi)
+    return min(d, 2*pi-d)
+
+def _sqrtSumSign(terms):
+    """Returns the sign, -1, 0 or 1, of the sum of a*sqrt(b) over up to three (a, b) pairs of integers, computed exactly."""
+    pos=[a*a*b for (a,b) in terms if a>0 and b]
+    neg=[a*a*b for (a,b) in terms if a<0 and b]
+    sign=1
+    if len(neg)>len(pos):
+        (pos, neg, sign)=(neg, pos, -1)
+    if not neg:
+        return sign if pos else 0
+    if len(pos)==1:
+        return sign*cmp(pos[0], neg[0])
+    #sqrt(a)+sqrt(b)-sqrt(c) has the sign of a+b-c+2*sqrt(a*b)
+    ((a,b),c)=(pos, neg[0])
+    t=a+b-c
+    if t>=0:
+        return sign if t or a*b else 0
+    return sign*cmp(4*a*b, t*t)
+
+def _pointsSign(a, b, c):
+    """Returns the sign of RayPair._cross(A, B, C) for points of the form s*n, where n is the normal of a locus of offset
+    (x, y) and distance d_2, given as (s, (x, y, d_2, ...)) tuples, computed exactly."""
+    ((sa,(ax,ay,ad)),(sb,(bx,by,bd)),(sc,(cx,cy,cd)))=((a[0],a[1][0:3]),(b[0],b[1][0:3]),(c[0],c[1][0:3]))
+    return _sqrtSumSign(((sb*sc*(bx*cy-by*cx), ad), (-sa*sb*(bx*ay-by*ax), cd), (-sa*sc*(ax*cy-ay*cx), bd)))
+
 def rayPairFromFF(facing, fov):
     fov=2*pi-fov
     reflex=fov>=pi
@@ -56,62 +95,71 @@ def rayPairFromFF(facing, fov):
     left, right = ar((left[0], ar(left[1].transpose())[0])), ar((right[0],ar(right[1].transpose())[0]))
     logger.debug("left:"+str(left)+" right:"+str(right))
     rp=RayPair(None, None, reflex)
-    (rp._left, rp._right)=(left, right)
+    (rp.left, rp.right)=(tuple(map(tuple, left.tolist())), tuple(map(tuple, right.tolist())))
     return rp
 
+def _coneCovers(loci, facing, fov):
+    """Returns the (left, right) cover the view cone provides each locus but the origin, by locus id."""
+    loci=[l for l in loci if l.d_2]
+    cone={}
+    if not loci:
+        return cone
+    for (l, ((cover, line),)) in zip(loci, RayPair.calculateCovers([rayPairFromFF(facing, fov)], loci)):
+        cover_left, cover_right = 0, 0
+        if line==3:
+            cover_left, cover_right = float(cover[0]), float(cover[1])
+        elif line==0:
+            cover_left, cover_right = cover, cover
+        else:
+            cover=max(0.0, cover)
+            if line==1:
+                cover_left = cover
+            else:
+                cover_right = cover
+        cone[l.id]=(1.0 if cover_left>0.866 else cover_left, 1.0 if cover_right>0.866 else cover_right)
+    return cone
+
 class RayPair(object):
-    """A vector pair is defined by two pairs of points and whether these lines form a reflex angle."""
-    id=1
-    count_processed=0
+    """A vector pair is defined by two pairs of points and whether these lines form a reflex angle.
+
+    Rays are kept as ((x, y), (dx, dy)) tuples of floats, as 2-element arithmetic is much cheaper on floats than arrays."""
+    __slots__=['left', 'right', 'is_reflex', 'is_world']
     EPSILON=0.0000001 #woo yay, trying to compensate for floating point computation inaccuracies
 
     def __init__(self, left, right, reflex=False):
-        self.left=left  #left ray, as a (point, unit vector)
-        self.right=right #right ray, as a (point, unit vector)
+        self.left=RayPair._vectorize(left)  #left ray, as a (point, unit vector)
+        self.right=RayPair._vectorize(right) #right ray, as a (point, unit vector)
         self.is_reflex=reflex #when considered from the intersection, whether the vector pair makes a reflex angle (>pi)
         self.is_world=False #whether the linepair angle is 2*pi, i.e. the world
-        if logger.level<=logging.INFO:
-            self.culprits=[] #debug info
-        self.id=RayPair.id
-        RayPair.id+=1
-        if logger.level==logging.DEBUG:
-            logger.debug("Created linepair "+str(self.id))
     
+    def copy(self):
+        """Returns a copy that can be merged into while leaving this RayPair intact."""
+        lp=self.__class__.__new__(self.__class__)
+        (lp.left, lp.right, lp.is_reflex, lp.is_world)=(self.left, self.right, self.is_reflex, self.is_world)
+        return lp
+
+    @classmethod
+    def fromLocus(self, locus):
+        """Returns the RayPair of a LOS-blocking locus."""
+        return locus.toRayPair()
+
+    @classmethod
     def _vectorize(self, segment):
+        """Turns a segment between two points into a ray from the first point along the unit vector towards the second."""
         if segment is None:
             return None
-        seg=ar(segment)
-        vector=seg[1]-seg[0]
-        vector/=sqrt(sum(pow(vector,2)))
-        seg[1]=vector
-        return seg
-
-    def setLeft(self, left):
-        self._left=self._vectorize(left)
-    
-    def getLeft(self):
-        return self._left
-
-    def setRight(self, right):
-        self._right=self._vectorize(right)
-    
-    def getRight(self):
-        return self._right
-
-    left=property(getLeft, setLeft)
-    right=property(getRight, setRight)
+        ((x0,y0),(x1,y1))=segment
+        (dx,dy)=(x1-x0,y1-y0)
+        length=sqrt(dx*dx+dy*dy)
+        return ((x0,y0),(dx/length,dy/length))
 
     def __repr__(self):
-        r="RayPair<"+str(self.id)+" l:"+str(self.left[0])+","+str(self.left[1])+" r:"+str(self.right[0])+","+str(self.right[1])
+        r="RayPair<l:"+str(self.left[0])+","+str(self.left[1])+" r:"+str(self.right[0])+","+str(self.right[1])
         if self.is_world:
             r+=" (W)"
         if self.is_reflex:
             r+=" (ref)"
-        r+=">"
-        if logger.level<=logging.INFO:
-            for c in self.culprits:
-                r+="\n\t"+str(c)
-        return r
+        return r+">"
 
     def __cmp__(self, other):
         """Sort by clockwise direction."""
@@ -119,21 +167,17 @@ class RayPair(object):
     
     def mergeLocus(self, locus, line):
         """Updates the RayPair to contain the LOS-blocking locus provided."""
-        if logger.level<=logging.INFO:
-            self.culprits.append(locus)
-        if logger.level==logging.DEBUG:
-            logger.debug("Merging locus "+str(locus)+' '+str(line)+" into linepair "+str(self.id))
         if line==3:
             self.is_world = True
             return self
         if line==1:
             if RayPair._cross(self.right[0],self.left[0],locus.n) <= RayPair.EPSILON:
                 self.is_reflex=True
-            self.left=(locus.n, locus.coord+locus.n)
+            self.left=locus.rays[0]
         else:
-            if RayPair._cross(self.left[0],self.right[0],-locus.n) >= -RayPair.EPSILON:
+            if RayPair._cross(self.left[0],self.right[0],locus.rays[1][0]) >= -RayPair.EPSILON:
                 self.is_reflex=True
-            self.right=(-locus.n, locus.coord-locus.n)
+            self.right=locus.rays[1]
         return self
     
     @classmethod
@@ -141,8 +185,6 @@ class RayPair(object):
         """Merges two RayPairs by a LOS-blocking locus that they share."""
         (lp1,lp1_line)=lp1_tuplet
         (lp2,lp2_line)=lp2_tuplet
-        if logger.level==logging.DEBUG:
-            logger.debug("Merging linepairs "+str(lp1.id)+' '+str(lp1_line)+" and "+str(lp2.id)+' '+str(lp2_line))
         assert lp1!=lp2,str(lp1)+'=='+str(lp2)
         right=None
         left=None
@@ -157,29 +199,21 @@ class RayPair(object):
             if not reflex and RayPair._cross(lp2.right[0],lp2.left[0],lp1.left[0]) <= RayPair.EPSILON:
                 reflex=True
         lp=RayPair(None,None,reflex)
-        lp._left=left
-        lp._right=right
-        if logger.level<=logging.INFO:
-            lp.culprits=lp1.culprits
-            lp.culprits.extend(lp2.culprits)
+        lp.left=left
+        lp.right=right
         return lp
 
     def calculateCover(self, l):
         """Returns a tuple in the form (cover_amount: 0.0-1.0, side: 1 if left line, 2 if right line, 3 if both, 0 if doesn't matter)"""
-        RayPair.count_processed+=1
         if self.is_world:
-            if logger.level==logging.DEBUG:
-                logger.debug("We are world!")
             return (1.0,0)
+        (left_point,right_point)=(self.left[0],self.right[0])
+        (x,y)=l.coord
         if not self.is_reflex:
-            n=-(self.right[0]+self.left[0])/2
-            if RayPair._cross(self.left[0],self.right[0], l.coord+n)<0:
-                if logger.level==logging.DEBUG:
-                    logger.debug("We are south of the line.")
+            (nx,ny)=(-(right_point[0]+left_point[0])/2, -(right_point[1]+left_point[1])/2)
+            if RayPair._cross(left_point,right_point,(x+nx,y+ny))<0:
                 return (-1,2) #assuming next linepair is right
-        right=RayPair._crossVectors(self.right[1],l.coord-self.right[0]*2) #negative if locus entirely to the right
-        if logger.level==logging.DEBUG:
-            logger.debug('\t\tright:'+str(right))
+        right=RayPair._crossVectors(self.right[1],(x-right_point[0]*2,y-right_point[1]*2)) #negative if locus entirely to the right
         if right > -RayPair.EPSILON and right < RayPair.EPSILON: #account for potential floating point error to arrive at a "good enough" answer
             right=0 #tangent
         elif right > 1.0-RayPair.EPSILON:
@@ -187,9 +221,7 @@ class RayPair(object):
         if not self.is_reflex:
             if right < 0:
                 return (-1,2)
-        left=-RayPair._crossVectors(self.left[1],l.coord-self.left[0]*2) #negative if locus is entirely to the left
-        if logger.level==logging.DEBUG:
-            logger.debug('\t\tleft:'+str(left))
+        left=-RayPair._crossVectors(self.left[1],(x-left_point[0]*2,y-left_point[1]*2)) #negative if locus is entirely to the left
         if left > -RayPair.EPSILON and left < RayPair.EPSILON:
             left=0
         elif left > 1.0-RayPair.EPSILON:
@@ -205,7 +237,7 @@ class RayPair(object):
         #i guess we're a reflex angle, so things get harder...
         if left < 0 and right < 0:
             return (-1,2)
-        if(self.left[1].dot(self.right[1])<0):  #angle between vectors between 90 and 270, i.e. possibly 180
+        if(self.left[1][0]*self.right[1][0]+self.left[1][1]*self.right[1][1]<0):  #angle between vectors between 90 and 270, i.e. possibly 180
             if left == 1 and right == 1:
                 return (1.0, 0)
             if left - RayPair.EPSILON > right:
@@ -222,6 +254,48 @@ class RayPair(object):
             return (left,1)
         return (right,2)
     
+    @classmethod
+    def calculateCovers(self, raypairs, loci):
+        """Vectorized calculateCover of every locus against every RayPair.
+
+        Returns a list with a row per locus, each holding a (cover, side) tuple per RayPair, of the same form calculateCover returns."""
+        E=RayPair.EPSILON
+        left=ar([lp.left for lp in raypairs])
+        right=ar([lp.right for lp in raypairs])
+        reflex=ar([bool(lp.is_reflex) for lp in raypairs])
+        world=ar([bool(lp.is_world) for lp in raypairs])
+        coord=ar([l.coord for l in loci])
+        (cx,cy)=(coord[:,0,newaxis],coord[:,1,newaxis])
+        (l0x,l0y,l1x,l1y)=(left[:,0,0],left[:,0,1],left[:,1,0],left[:,1,1])
+        (r0x,r0y,r1x,r1y)=(right[:,0,0],right[:,0,1],right[:,1,0],right[:,1,1])
+        (nx,ny)=(-(r0x+l0x)/2,-(r0y+l0y)/2)
+        south=(r0x-l0x)*(cy+ny-l0y)-(r0y-l0y)*(cx+nx-l0x)<0
+        r=r1x*(cy-r0y*2)-r1y*(cx-r0x*2)
+        r=where((r>-E)&(r<E),0.0,where(r>1.0-E,1.0,r))
+        l=-(l1x*(cy-l0y*2)-l1y*(cx-l0x*2))
+        l=where((l>-E)&(l<E),0.0,where(l>1.0-E,1.0,l))
+        #the decision tree of calculateCover, applied from the last branch to the first so that earlier branches take precedence
+        obtuse=(l1x*r1x+l1y*r1y<0)
+        cover=where(l>=0,l,r)
+        side=where(l>=0,where(r>=0,3,1),2)
+        full=(l==1)|(r==1)
+        cover=where(full,1.0,cover)
+        side=where(full,0,side)
+        pick_left=(l-E>r)|((l+E>r)&((-l1y)*cy-l1x*cx<0))
+        full=(l==1)&(r==1)
+        cover=where(obtuse,where(full,1.0,where(pick_left,l,r)),cover)
+        side=where(obtuse,where(full,0,where(pick_left,1,2)),side)
+        hidden=(l<0)&(r<0)
+        cover=where(hidden,-1.0,cover)
+        side=where(hidden,2,side)
+        cover=where(reflex,cover,where(south|(r<0),-1.0,where(l<0,-1.0,where(l<r,l,where(r<1,r,1.0)))))
+        side=where(reflex,side,where(south|(r<0),2,where(l<0,1,where(l<r,1,where(r<1,2,0)))))
+        side=where(world,0,side)
+        rows=[zip(c,sd) for (c,sd) in zip(where(world,1.0,cover).tolist(),side.tolist())]
+        for (i,j) in argwhere(side==3).tolist():
+            rows[i][j]=((l[i,j],r[i,j]),3)
+        return rows
+
     @classmethod
     def _cross(self, p1, p2, p3):
         """Returns positive value, 0, or negative value, if p3 is left, on, or right of the line going from p1 to p2."""
@@ -232,21 +306,148 @@ class RayPair(object):
         """Returns positive value, 0, or negative value, if v2 is counter-clockwise, on, or clockwise of v2."""
         return v1[0]*v2[1]-v1[1]*v2[0]
 
+class ExactRayPair(RayPair):
+    """A RayPair made of the rays of loci, whose tests are carried out exactly in integer arithmetic.
+
+    The ray bounding a locus on either side runs at half the locus diameter from the parallel line through its center, so
+    a cover against it is 1-sqrt(3/4)*u/sqrt(d_2), where u is an integer cross product of hex coordinates and d_2 that of
+    the locus, and every test, on covers or on the points rays start from, comes down to the sign of a sum of at most
+    three integer multiples of square roots of integers.  Covers are only turned into floats to be returned.
+
+    The source of each ray is kept as (x, y, d_2, sqrt(3/4)/sqrt(d_2)) for the locus it bounds."""
+    __slots__=['left_src', 'right_src']
+
+    def copy(self):
+        lp=RayPair.copy(self)
+        (lp.left_src, lp.right_src)=(self.left_src, self.right_src)
+        return lp
+
+    @classmethod
+    def fromLocus(self, locus):
+        """Returns the RayPair of a LOS-blocking locus."""
+        lp=ExactRayPair(None,None,False)
+        (lp.left,lp.right)=locus.rays
+        lp.left_src=lp.right_src=ExactRayPair._source(locus)
+        return lp
+
+    @classmethod
+    def _source(self, locus):
+        return (locus.id[0], locus.id[1], locus.d_2, SQRT3_4/sqrt(locus.d_2))
+
+    def mergeLocus(self, locus, line):
+        """Updates the RayPair to contain the LOS-blocking locus provided."""
+        if line==3:
+            self.is_world = True
+            return self
+        src=ExactRayPair._source(locus)
+        if line==1:
+            if _pointsSign((-1,self.right_src),(1,self.left_src),(1,src))<=0:
+                self.is_reflex=True
+            (self.left, self.left_src)=(locus.rays[0], src)
+        else:
+            if _pointsSign((1,self.left_src),(-1,self.right_src),(-1,src))>=0:
+                self.is_reflex=True
+            (self.right, self.right_src)=(locus.rays[1], src)
+        return self
+
+    @classmethod
+    def mergePairsByLocus(self, lp1_tuplet, lp2_tuplet):
+        """Merges two RayPairs by a LOS-blocking locus that they share."""
+        (lp1,lp1_line)=lp1_tuplet
+        (lp2,lp2_line)=lp2_tuplet
+        assert lp1!=lp2,str(lp1)+'=='+str(lp2)
+        assert lp1_line!=lp2_line, str(lp1_line)+'=='+str(lp2_line)
+        reflex=(lp1.is_reflex or lp2.is_reflex)
+        if lp1_line==1:
+            (first, second)=(lp2, lp1)
+            if not reflex and _pointsSign((-1,lp1.right_src),(1,lp1.left_src),(1,lp2.left_src))<=0:
+                reflex=True
+        else:
+            (first, second)=(lp1, lp2)
+            if not reflex and _pointsSign((-1,lp2.right_src),(1,lp2.left_src),(1,lp1.left_src))<=0:
+                reflex=True
+        lp=ExactRayPair(None,None,reflex)
+        (lp.left, lp.left_src, lp.right, lp.right_src)=(first.left, first.left_src, second.right, second.right_src)
+        return lp
+
+    def calculateCover(self, l):
+        """Returns a tuple in the form (cover_amount: 0.0-1.0, side: 1 if left line, 2 if right line, 3 if both, 0 if doesn't matter)"""
+        if self.is_world:
+            return (1.0,0)
+        (lx,ly,ld,lk)=self.left_src
+        (rx,ry,rd,rk)=self.right_src
+        (x,y)=l.id
+        if not self.is_reflex:
+            if _sqrtSumSign(((2*rx*x+2*ry*y-rx*y-ry*x, ld), (2*lx*x+2*ly*y-lx*y-ly*x, rd), (rx*ly-ry*lx, 3)))<0:
+                return (-1,2) #south of the line between the points the rays start from
+        ur=ry*x-rx*y #how far the locus reaches past the right ray, scaled by sqrt(d_2/(3/4))
+        right_hidden=ur>0 and 3*ur*ur>4*rd
+        right=1.0 if ur<=0 else (0 if 3*ur*ur==4*rd else 1.0-rk*ur)
+        if not self.is_reflex and right_hidden:
+            return (-1,2)
+        ul=lx*y-ly*x
+        left_hidden=ul>0 and 3*ul*ul>4*ld
+        left=1.0 if ul<=0 else (0 if 3*ul*ul==4*ld else 1.0-lk*ul)
+        left_less=ul>0 and (ur<=0 or ul*ul*rd>ur*ur*ld) #left<right
+        if not self.is_reflex:
+            if left_hidden:
+                return (-1,1)
+            if left_less:
+                return (left, 1)
+            if ur>0:
+                return (right, 2)
+            return (1.0,0)
+        if left_hidden and right_hidden:
+            return (-1,2)
+        if 2*lx*rx+2*ly*ry-lx*ry-ly*rx<0: #angle between vectors between 90 and 270, i.e. possibly 180
+            if ul<=0 and ur<=0:
+                return (1.0, 0)
+            if ur>0 and (ul<=0 or ur*ur*ld>ul*ul*rd): #left>right
+                return (left, 1)
+            if not left_less and 2*lx*x+2*ly*y-lx*y-ly*x>0:
+                return (left, 1)
+            return (right, 2)
+        if ul<=0 or ur<=0:
+            return (1.0, 0)
+        if not left_hidden:
+            if not right_hidden:
+                return ((left,right),3)
+            return (left,1)
+        return (right,2)
+
+    @classmethod
+    def calculateCovers(self, raypairs, loci):
+        """calculateCover of every locus against every RayPair, in the form RayPair.calculateCovers returns."""
+        return [[lp.calculateCover(l) for lp in raypairs] for l in loci]
+
 class Locus(object):
     """Generally speaking, a circle positioned using Cartesian coordinates that may block line of sight."""
+    __slots__=['id', 'd_2', 'coord', 'n', 'key', 'rays', 'blocksLOS', 'cover_left', 'cover_right', 'table', 'position']
     T=ar([[-SQRT3_4, SQRT3_4, 0.0],[-0.5, -0.5, 0.0], [0.0, 0.0, 1.0]]) #hex -> cartesian
 
     def __init__(self, coord_blocks_triple):
         (x, y, self.blocksLOS)=coord_blocks_triple
         self.id=(x,y)
         self.d_2=x*x+y*y-x*y
-        coord=Locus.T.dot((x,y,1))
-        factor=sqrt(coord[0]*coord[0]+coord[1]*coord[1])*2.0
-        n=ar((-coord[1]/factor, coord[0]/factor)) #rotate -pi/2 and scale producing the 'left' normal
-        self.coord=coord[0:2]
-        self.n=n
+        coord=tuple(Locus.T.dot((x,y,1))[0:2].tolist())
+        self.coord=coord
         self.cover_left=0.0
         self.cover_right=0.0
+        if not self.d_2:
+            (self.n, self.key, self.rays)=((0.0,0.0), _clockwiseKey((0.0,0.0)), None) #the origin never blocks line of sight
+            return
+        factor=sqrt(coord[0]*coord[0]+coord[1]*coord[1])*2.0
+        n=(-coord[1]/factor, coord[0]/factor) #rotate -pi/2 and scale producing the 'left' normal
+        self.n=n
+        self.key=_clockwiseKey((-n[0],-n[1])) #where the right ray of this locus's RayPair sorts
+        self.rays=(RayPair._vectorize((n,(coord[0]+n[0],coord[1]+n[1]))), RayPair._vectorize(((-n[0],-n[1]),(coord[0]-n[0],coord[1]-n[1])))) #the left and right rays of its RayPair
+
+    def __getattr__(self, name):
+        """Fills in the geometry of a locus created by an OffsetTable, which only sets its id and d_2, on first use."""
+        if name not in ('coord', 'n', 'key', 'rays'):
+            raise AttributeError(name)
+        self.table._fill(self)
+        return getattr(self, name)
 
     def __cmp__(self, other):
         """Comparison by distance from origin and clockwise angle around the origin from the y axis."""
@@ -266,15 +467,382 @@ class Locus(object):
     
     def toRayPair(self):
         """Returns the relevant RayPair for this locus, used if this locus blocks line of sight."""
-        lp=RayPair((self.n,self.coord+self.n),(-self.n,self.coord-self.n),False)
-        if logger.level<=logging.INFO:
-            lp.culprits.append(self)
-        if logger.level==logging.DEBUG:
-            logger.debug("Created linepair "+str(lp.id)+" from locus "+str(self))
+        lp=RayPair(None,None,False)
+        (lp.left,lp.right)=self.rays
         return lp
 
+class OffsetTable(object):
+    """Locus geometry for every offset from the observer within the given extents, in the order the loci are visited.
+
+    Offsets are sorted by distance and then clockwise, and their geometry depends only on the offset, hence tables are
+    built once and shared by all FOV instances.  The geometry is kept in arrays, under a hundred bytes per offset, that
+    loci turns into the Locus objects a sweep takes.  Tables bounded by a radius are small, and the CAPACITY most recently
+    used ones are kept; those that are not span twice the extents of the level, and only the FULL_CAPACITY most recently
+    used ones are kept apart from them, so that the tables of light radii cannot evict the one of the player."""
+    CAPACITY=8
+    FULL_CAPACITY=1
+    ROWS=1<<14
+    tables=OrderedDict() #by (width, height, radius)
+    full=OrderedDict() #by (width, height), for no radius
+
+    def __init__(self, width, height, radius=None):
+        if radius is None:
+            loci=[Locus((x,y,False)) for x in xrange(-width,width+1) for y in xrange(-height,height+1)]
+        else:
+            #only offsets within radius are generated: x*x+y*y-x*y<=radius*radius bounds y for each x
+            radius_2=radius*radius
+            loci=[]
+            for x in xrange(-width,width+1):
+                spread=sqrt(max(0, 4*radius_2-3*x*x))
+                for y in xrange(max(-height, int((x-spread)/2)-1), min(height, int((x+spread)/2)+1)+1):
+                    if x*x+y*y-x*y<=radius_2:
+                        loci.append(Locus((x,y,False)))
+        loci.sort()
+        self.extents=(width, height)
+        self.offsets=ar([l.id for l in loci], dtype=int32).reshape((len(loci), 2))
+        self.d_2=ar([l.d_2 for l in loci], dtype=int32)
+        #coord, n and the directions of the left and right rays; the rays start at n and -n, and key follows from n
+        self.geometry=ar([l.coord+l.n+(l.rays[0][1]+l.rays[1][1] if l.rays else (0.0,0.0,0.0,0.0)) for l in loci]).reshape((len(loci), 8))
+        self._positions=-ones((2*width+1, 2*height+1), dtype=int32) #by offset, -1 for those beyond radius
+        self._positions[self.offsets[:,0]+width, self.offsets[:,1]+height]=arange(len(loci))
+        self.cones={}
+        self.sectors={}
+        self._shadows=None #see shadows
+        self._rows={} #the geometry of the positions filled so far, by position, as _loci sets it
+
+    def __len__(self):
+        return len(self.d_2)
+
+    def position(self, offset):
+        """Returns the position of offset in the visit order, or None if the table does not hold it."""
+        (width, height)=self.extents
+        if abs(offset[0])>width or abs(offset[1])>height:
+            return None
+        p=int(self._positions[offset[0]+width, offset[1]+height])
+        return p if p>=0 else None
+
+    def positions(self, offsets):
+        """Returns the positions of a list of offsets in the visit order as an array, with -1 for those the table does not
+        hold."""
+        (width, height)=self.extents
+        offsets=ar(offsets, dtype=int32).reshape((len(offsets), 2))
+        inside=(absolute(offsets[:,0])<=width)&(absolute(offsets[:,1])<=height)
+        ret=-ones(len(offsets), dtype=int32)
+        ret[inside]=self._positions[offsets[inside,0]+width, offsets[inside,1]+height]
+        return ret
+
+    def loci(self, blocks, d_min=0, keep=None):
+        """Returns a Locus for every offset of the dict blocks, which gives their blocksLOS, that the table holds and that
+        is at least d_min away, in reverse visit order, so that a sweep pops them off the end.  If keep is given, only the
+        offsets for which keep(offset, blocksLOS) holds are."""
+        offsets=blocks.keys()
+        positions=self.positions(offsets)
+        visit=positions.argsort()[::-1]
+        visit=visit[positions[visit]>=0]
+        if d_min:
+            visit=visit[self.d_2[positions[visit]]>=d_min]
+        visit=visit.tolist()
+        if keep is not None:
+            visit=[i for i in visit if keep(offsets[i], blocks[offsets[i]])]
+        return self._loci(positions[visit], [blocks[offsets[i]] for i in visit], [offsets[i] for i in visit])
+
+    def _loci(self, positions, blocking, ids=None):
+        """Returns a Locus for every position of an array of them, blocking line of sight as given by blocking, with ids
+        their offsets if already at hand.  Only their id and d_2 are set, the rest of their geometry is filled in once used
+        (see Locus.__getattr__), as most loci of a sweep are found covered, or not, without testing them."""
+        if ids is None:
+            ids=[tuple(o) for o in self.offsets[positions].tolist()]
+        ret=[]
+        new=Locus.__new__
+        rows=self._rows
+        for (i, d_2, p, b) in zip(ids, self.d_2[positions].tolist(), positions.tolist(), blocking):
+            l=new(Locus)
+            (l.id, l.d_2, l.blocksLOS, l.cover_left, l.cover_right, l.table, l.position)=(i, d_2, b, 0.0, 0.0, self, p)
+            row=rows.get(p)
+            if row is not None:
+                (l.coord, l.n, l.key, l.rays)=row
+            ret.append(l)
+        return ret
+
+    def _fill(self, locus):
+        """Sets the coord, n, key and rays of a Locus created by _loci, and keeps them for the loci created at the same
+        position later on, up to ROWS positions."""
+        (cx,cy,nx,ny,lx,ly,rx,ry)=self.geometry[locus.position].tolist()
+        n=(nx,ny)
+        if locus.d_2:
+            row=((cx,cy), n, (0,ny) if nx<0 else (1,-ny), ((n,(lx,ly)),((-nx,-ny),(rx,ry)))) #key is _clockwiseKey((-nx,-ny))
+        else:
+            row=((cx,cy), n, _clockwiseKey((0.0,0.0)), None)
+        (locus.coord, locus.n, locus.key, locus.rays)=row
+        if len(self._rows)<OffsetTable.ROWS:
+            self._rows[locus.position]=row
+
+    def cone(self, facing, fov):
+        """Returns the (left, right) cover the view cone of facing and fov provides each offset, and the subset of those
+        it covers fully, which need not be processed unless they block line of sight; both are built on first use."""
+        key=(tuple(facing), fov)
+        try:
+            return self.cones[key]
+        except KeyError:
+            cone=_coneCovers(self._loci(arange(len(self)), [False]*len(self)), facing, fov)
+            culled=dict([(i, c) for (i, c) in cone.iteritems() if c[0]==1.0 or c[1]==1.0])
+            self.cones[key]=(cone, culled)
+            return (cone, culled)
+
+    def sector(self, index, count):
+        """Returns the offsets whose centers lie in the index-th of count equal angular sectors, counterclockwise from the
+        negative x axis, and the offsets a blocking locus at which would reach into it; both are built on first use.
+
+        A blocking locus only casts its shadow within the angle it subtends, which is largest at its own distance, but
+        merged linepairs carry cover a little further, hence SECTOR_MARGIN."""
+        try:
+            return self.sectors[count][index]
+        except KeyError:
+            width=2*pi/count
+            sectors=[(set(), set()) for i in xrange(count)]
+            for (offset, d_2, (x,y)) in zip(self.offsets.tolist(), self.d_2.tolist(), self.geometry[:,0:2].tolist()):
+                if not d_2:
+                    continue
+                offset=tuple(offset)
+                angle=atan2(y, x)+pi
+                half=asin(min(1.0, 0.5/sqrt(d_2)))+RayPair.EPSILON+SECTOR_MARGIN
+                sectors[min(int(angle/width), count-1)][0].add(offset)
+                for i in xrange(int((angle-half)//width), int((angle+half)//width)+1):
+                    sectors[i%count][1].add(offset)
+            self.sectors[count]=sectors
+            return sectors[index]
+
+    def shadows(self):
+        """Returns the shadows every locus would cast were it the only one blocking line of sight, and every pair of
+        adjacent loci would cast together, all built on first use, as (neighbors, starts, positions, left, right) arrays:
+        the positions of the six neighbors of each offset, or len(self) for those the table does not hold, and the shadows,
+        the k-th of the offset at position i being positions[starts[4*i+k]:starts[4*i+k+1]] with the cover either ray
+        provides them; k=0 is the locus alone and k=1..3 the locus together with its neighbor along HEX_NEIGHBORS[k-1].
+        Shadows are only meant for tables bounded by a radius, as a full-map table would hold several for every pair of
+        offsets.
+
+        The rays of a locus run parallel to its direction, so only the loci further away than either locus and within a
+        unit of the axis of either, or between the two, are tested.  Overlaying single shadows alone would leave a wedge of light
+        behind the seam of every pair of adjacent loci."""
+        if self._shadows is not None:
+            return self._shadows
+        size=len(self)
+        (cx,cy)=(self.geometry[:,0],self.geometry[:,1])
+        d_2=self.d_2
+        neighbors=zeros((size, 6), dtype=int32)
+        for (k, n) in enumerate(HEX_NEIGHBORS):
+            neighbors[:,k]=self.positions(self.offsets+n)
+        neighbors[neighbors<0]=size
+        loci=self._loci(arange(size), [True]*size)
+        (starts, positions, left, right)=([0], [], [], [])
+        for (i, l) in enumerate(loci):
+            for k in xrange(4):
+                if not l.d_2 or (k and neighbors[i][k-1]==size):
+                    starts.append(starts[-1])
+                    continue
+                casting=[l]
+                if k:
+                    casting.append(loci[neighbors[i][k-1]])
+                    if not casting[1].d_2:
+                        starts.append(starts[-1])
+                        continue
+                axes=[(c.coord[0]/sqrt(c.d_2), c.coord[1]/sqrt(c.d_2)) for c in casting]
+                tested=zeros(size, dtype=bool)
+                for (ux,uy) in axes:
+                    tested|=(absolute(cx*uy-cy*ux)<1.0)&(cx*ux+cy*uy>0)
+                if not k:
+                    lp=l.toRayPair()
+                else:
+                    ((ax,ay),(bx,by))=axes
+                    tested|=((ax*cy-ay*cx)*(bx*cy-by*cx)<=0)&(cx*(ax+bx)+cy*(ay+by)>0)
+                    if ax*by-ay*bx<0:
+                        casting.reverse() #the left ray is the one of the counterclockwise locus
+                    lp=RayPair(None, None)
+                    (lp.left, lp.right)=(casting[1].rays[0], casting[0].rays[1])
+                cast=argwhere(tested&(d_2>max([c.d_2 for c in casting])))[:,0].tolist()
+                if cast:
+                    rows=RayPair.calculateCovers([lp], [loci[j] for j in cast])
+                    for ((cover,side),) in rows:
+                        if side==3:
+                            (cl, cr)=cover
+                        elif side==1 or (side==0 and cover>=0):
+                            (cl, cr)=(cover, 0.0)
+                        elif side==2 and cover>=0:
+                            (cl, cr)=(0.0, cover)
+                        else:
+                            (cl, cr)=(0.0, 0.0)
+                        left.append(cl)
+                        right.append(cr)
+                positions.extend(cast)
+                starts.append(len(positions))
+        self._shadows=(neighbors, ar(starts, dtype=int32), ar(positions, dtype=int32), ar(left), ar(right))
+        return self._shadows
+
+    @classmethod
+    def get(self, width, height, radius=None):
+        """Returns the cached table covering offsets up to width and height away, built on first use.
+
+        No offset within radius is more than 2/sqrt(3) times radius away along either axis, so the extents are capped
+        there, and levels of any size larger than that share the same table."""
+        if radius is None:
+            (tables, key, capacity)=(OffsetTable.full, (width, height), OffsetTable.FULL_CAPACITY)
+        else:
+            reach=int(2*radius/sqrt(3))
+            (tables, key, capacity)=(OffsetTable.tables, (min(width, reach), min(height, reach), radius), OffsetTable.CAPACITY)
+        try:
+            table=tables.pop(key)
+        except KeyError:
+            if len(tables)>=capacity:
+                tables.popitem(last=False) #before building, so that both are never held at once
+            table=OffsetTable(key[0], key[1], radius)
+        tables[key]=table
+        return table
+
+class _Snapshot(object):
+    """The last sweep of an incremental FOV, kept so that it can be resumed from any of its rings."""
+    def __init__(self, me, fov, facing, radius, blocks, table, visited, beyond, checkpoints, linepairs, cone, culled):
+        self.me=me
+        self.fov=fov
+        self.facing=facing
+        self.radius=radius
+        self.cone=cone
+        self.culled=culled
+        self.blocks=blocks
+        self.table=table
+        self.beyond=beyond
+        self.checkpoints=checkpoints
+        self.update(visited, linepairs)
+
+    def update(self, visited, linepairs):
+        """Records the processed loci and final linepairs, and finds how many loci were processed before the first
+        reflex linepair could have appeared."""
+        self.visited=visited
+        self.loci=dict([(l.id, l) for l in visited])
+        self.reflex_at=len(visited)+1
+        start=0
+        for d_2 in sorted(self.checkpoints.keys()):
+            (index, checkpoint)=self.checkpoints[d_2]
+            if [lp for lp in checkpoint if lp.is_reflex or lp.is_world]:
+                self.reflex_at=start
+                return
+            start=index
+        if [lp for lp in linepairs if lp[0].is_reflex or lp[0].is_world]:
+            self.reflex_at=start
+
+class _DirtySectors(object):
+    """Angular sectors around the observer in which an incremental update has to recompute cover."""
+    def __init__(self, snapshot):
+        self.sectors=[] #as (angle, half width) tuples
+        self.previous=snapshot.loci
+        self.reflex_at=snapshot.reflex_at
+        self.processed=[]
+        self.ring=False #whether the rest of the current ring has to be recomputed
+
+    def add(self, locus):
+        """Marks the sector in which the locus can alter linepairs as dirty.
+
+        Rays passing through a locus at distance d from the observer, both being discs of diameter 1, stay within
+        atan(1/(d-1)) of its direction past it; a wider angle is used to also account for the rays leading up to it."""
+        angle=atan2(locus.coord[1], locus.coord[0])
+        width=atan2(1.0, sqrt(locus.d_2)-1.5)+RayPair.EPSILON
+        for (a, w) in self.sectors:
+            if _angleBetween(angle, a)+width<=w:
+                return
+        self.sectors.append((angle, width))
+
+    def touches(self, locus):
+        """Whether any part of the locus lies within a dirty sector."""
+        angle=atan2(locus.coord[1], locus.coord[0])
+        width=asin(min(1.0, 0.5/sqrt(locus.d_2)))
+        for (a, w) in self.sectors:
+            if _angleBetween(angle, a)<=w+width:
+                return True
+        return False
+
+class Tracer(object):
+    """Receives the events of a FOV sweep.  This one ignores them, and a FOV given none does not even make the calls, so
+    subclasses only override the events they are interested in."""
+    def locusProcessed(self, locus, linepairs):
+        """A locus is about to be tested against linepairs, a list of [RayPair, freshness] lists."""
+        pass
+
+    def pairCreated(self, raypair, locus):
+        """A LOS-blocking locus covered by no linepair became a RayPair of its own."""
+        pass
+
+    def pairMerged(self, raypair, locus, merged):
+        """A LOS-blocking locus was merged into the RayPair merged[0], or joined merged[0] and merged[1] into raypair."""
+        pass
+
+    def coverAssigned(self, locus):
+        """The cover of a locus, before the view cone, is final."""
+        pass
+
+class LoggingTracer(Tracer):
+    """Logs every event of a FOV sweep at debug level."""
+    def locusProcessed(self, locus, linepairs):
+        logger.debug(str(locus)+' '+str(len(linepairs)))
+        for linepair in linepairs:
+            logger.debug('\t'+str(linepair))
+
+    def pairCreated(self, raypair, locus):
+        logger.debug('Created linepair '+str(raypair)+' from locus '+str(locus))
+
+    def pairMerged(self, raypair, locus, merged):
+        logger.debug('Merged locus '+str(locus)+' into '+' and '.join([str(lp) for lp in merged])+': '+str(raypair))
+
+    def coverAssigned(self, locus):
+        logger.debug('Covered '+str(locus))
+
+class FOVStats(object):
+    """Counts of the work done by one call to FOV: the loci tested against linepairs, the tests of a locus against a
+    RayPair, and the RayPairs created and merged into.  Loci whose cover is known without testing them (culled by the
+    view cone, buried, kept from the previous sweep or enclosed) are not counted.  An approximate FOV counts the loci
+    given cover by shadows, the loci each shadow was overlaid on, and the shadows cast, as it creates no RayPairs."""
+    __slots__=['loci', 'covers', 'pairs', 'merges']
+
+    def __init__(self):
+        (self.loci, self.covers, self.pairs, self.merges)=(0, 0, 0, 0)
+
+    def add(self, other):
+        """Adds the counts of other to these."""
+        (self.loci, self.covers, self.pairs, self.merges)=(self.loci+other.loci, self.covers+other.covers, self.pairs+other.pairs, self.merges+other.merges)
+
+    def __repr__(self):
+        return "FOVStats<loci:"+str(self.loci)+" covers:"+str(self.covers)+" pairs:"+str(self.pairs)+" merges:"+str(self.merges)+">"
+
 class FOV(object):
-    """Field of View calculator."""
+    """Field of View calculator.
+
+    An incremental FOV keeps the state of its last sweep so that updateHexFOV can recompute it after local changes.  An
+    exact FOV tests shadows with ExactRayPair, so that its results do not depend on floating point error, and are the
+    same on any machine; only the view cone is still computed in floating point.  An approximate FOV does not sweep
+    within a radius, but overlays the shadows each blocking locus would cast on its own (see OffsetTable.shadows); it is
+    meant for observers whose view need not be exact, and approximationError measures how far off it is.
+
+    Sweeps report their events to tracer, if one is given, and count their work in stats, a FOVStats replaced by every
+    call; neither is shared between instances."""
+    BATCH_SIZE=12 #smallest ring whose cover is worth computing in bulk
+
+    def __init__(self, incremental=False, exact=False, approximate=False, tracer=None):
+        self.incremental=incremental
+        self.exact=exact
+        self.approximate=approximate
+        self.tracer=tracer if tracer is not None else Tracer()
+        self.stats=FOVStats()
+        self._snapshot=None
+        self._progress=None
+
+    def __getstate__(self):
+        state=dict(self.__dict__)
+        state['_snapshot']=None
+        state['_progress']=None
+        return state
+
+    def __setstate__(self, state):
+        self.__init__() #defaults for whatever a FOV saved by an older version lacks
+        self.__dict__.update(state)
+
     def _processOrigin(self, loci, processed_loci):
         while len(loci) and loci[-1].d_2==0:
             l=loci.pop()
@@ -282,87 +850,524 @@ class FOV(object):
             l.cover_right=0.0
             processed_loci.append(l)
     
-    def _processInitialFOV(self, loci, facing, fov):
-        raypair=rayPairFromFF(facing, fov)
+    def _processInitialFOV(self, loci, cone):
         for l in loci:
-            if l.id!=(0,0):
-                cover_left, cover_right = 0, 0
-                (cover, line)=raypair.calculateCover(l)
-                if line==3:
-                    cover_left, cover_right = cover
-                elif line==0:
-                    cover_left, cover_right = cover, cover
-                else:
-                    cover=max(0.0, cover)
-                    if line==1:
-                        cover_left = cover
-                    else:
-                        cover_right = cover
-                l.cover_left, l.cover_right = max(l.cover_left, 1.0 if cover_left>0.866 else cover_left), max(l.cover_right, 1.0 if cover_right>0.866 else cover_right)
+            if l.id in cone:
+                (cover_left, cover_right)=cone[l.id]
+                l.cover_left, l.cover_right = max(l.cover_left, cover_left), max(l.cover_right, cover_right)
         
-    def calculateHexFOV(self, me, world, fov=None, facing=None):
-        """Calculate Field of View from triples of the form (x,y,blocksLOS) where x and y are in hex coordinates."""
+    def calculateHexFOV(self, me, world, fov=None, facing=None, radius=None, exposed=None, sector=None, out=None):
+        """Calculate Field of View from triples of the form (x,y,blocksLOS) where x and y are in hex coordinates.
+
+        If radius is given, tiles further than radius away from me are returned fully covered without being processed.
+        If exposed is given, it is the set of (x,y) blocking tiles with a neighbor that does not block line of sight, as
+        kept by Level; the other blocking tiles are buried, and are taken to be fully covered without being processed as
+        soon as all their nearer neighbors are.
+        If sector is given, it is an (index, count) pair, and only the tiles in that angular sector (see
+        OffsetTable.sector), me and those beyond radius are processed and returned, together with the blocking tiles
+        close enough to its edges to shadow it; merging the sectors by maximum cover then agrees with the whole Field of
+        View, save for rare partial covers that merged linepairs carry across the edges.  Sectors are not kept for
+        updateHexFOV.
+        If out is given, it is a (cover, d_2) pair of arrays indexed by (x,y), into which the Field of View is written
+        rather than returned as a list; out is returned instead.
+        An approximate FOV ignores exposed and sector, and keeps no state for updateHexFOV either; without a radius it
+        sweeps all the same, as the shadows of a full-map table would take too long to build and too much memory to keep."""
+        if self.approximate and radius is not None:
+            return self._approximateHexFOV(me, world, fov, facing, radius, out)
         result=None
-        for result in self.hexFOVGenerator(me, world, fov, facing, yield_each_iteration=False):
+        for result in self.hexFOVGenerator(me, world, fov, facing, yield_each_iteration=False, radius=radius, exposed=exposed, sector=sector, out=out):
             pass
         return result[0]
 
-    def hexFOVGenerator(self, me, world, fov=None, facing=None, yield_each_iteration=True):
-        """Auxiliary function for calculateHexFOV."""
-        loci=[Locus((i[0]-me[0],i[1]-me[1],i[2])) for i in world]
-        loci.sort(reverse=True)
+    def hexFOVGenerator(self, me, world, fov=None, facing=None, yield_each_iteration=True, radius=None, exposed=None, sector=None, out=None):
+        """Auxiliary function for calculateHexFOV.
+
+        If yield_each_iteration is set, yields ([((x,y), cover, d_2)], next) for just the locus processed last, where next
+        is the offset of the locus to be processed after it; currentHexFOV returns everything processed so far.  The
+        final item is always (the whole Field of View, None), or (out, None) if out is given, as the facing cone is only
+        applied at the end."""
+        self.stats=FOVStats()
+        beyond=[]
+        blocks={}
+        (x,y)=(me[0],me[1])
+        if radius is None:
+            for i in world:
+                blocks[i[0]-x,i[1]-y]=i[2]
+        else:
+            radius_2=radius*radius
+            for i in world:
+                (dx,dy)=(i[0]-x,i[1]-y)
+                d_2=dx*dx+dy*dy-dx*dy
+                if d_2>radius_2:
+                    beyond.append(((i[0],i[1]),1.0,d_2))
+                else:
+                    blocks[dx,dy]=i[2]
+        if world:
+            width=max([i[0] for i in world])-min([i[0] for i in world])
+            height=max([i[1] for i in world])-min([i[1] for i in world])
+        else:
+            width, height=0, 0
+        table=OffsetTable.get(width, height, radius)
+        if sector is None:
+            loci=table.loci(blocks)
+        else:
+            (home, reach)=table.sector(*sector)
+            loci=table.loci(blocks, keep=lambda offset, b: offset in home or offset==(0,0) or (b and offset in reach))
         ret=[]
+        self._progress=(ret, me)
         self._processOrigin(loci, ret)
-        RayPair.id=1
+        if yield_each_iteration and loci:
+            yield (self.currentHexFOV(), loci[-1].id)
+        linepairs=[] #as [RayPair, freshness] lists
+        #freshness affects whether the line(s) actually provide cover or are only considered as neighbors to blocking loci
+        #freshness can be 1 (left is fresh), 2 (right is fresh), 3 (both), or 0 (neither)
+        checkpoints={} if self.incremental else None
+        (cone, culled)=(None, None)
+        if fov is not None and facing is not None:
+            (cone, culled)=table.cone(facing, fov)
+        for result in self._sweep(loci, ret, linepairs, me, yield_each_iteration, checkpoints=checkpoints, culled=culled, exposed=exposed):
+            yield result
+        if cone is not None:
+            self._processInitialFOV(ret, cone)
+        if sector is not None:
+            ret=[i for i in ret if i.id in home or not i.d_2]
+        elif self.incremental:
+            self._snapshot=_Snapshot(me, fov, facing, radius, blocks, table, ret, beyond, checkpoints, linepairs, cone, culled)
+        if out is not None:
+            yield (self._writeArrays(ret, me, beyond, out), None)
+        else:
+            yield ([((i.id[0]+x, i.id[1]+y), min(i.cover_right+i.cover_left,1.0), i.d_2) for i in ret]+beyond,None)
+
+    def _writeArrays(self, loci, me, beyond, out):
+        """Writes the cover and d_2 of loci around me, and of the tiles beyond radius, into the out arrays."""
+        (cover, d_2)=out
+        if loci:
+            (xs, ys)=([l.id[0]+me[0] for l in loci], [l.id[1]+me[1] for l in loci])
+            cover[xs, ys]=minimum(ar([l.cover_right for l in loci])+ar([l.cover_left for l in loci]), 1.0)
+            d_2[xs, ys]=[l.d_2 for l in loci]
+        if beyond:
+            (xs, ys)=([b[0][0] for b in beyond], [b[0][1] for b in beyond])
+            cover[xs, ys]=1.0
+            d_2[xs, ys]=[b[2] for b in beyond]
+        return out
+
+    def _approximateHexFOV(self, me, world, fov, facing, radius, out=None):
+        """calculateHexFOV by overlaying the shadows of the blocking loci that are not buried and of every adjacent pair
+        of them: the cover each ray provides is the largest any shadow does, and the cover of a locus is the sum of the
+        two, as for a linepair.  The shadows come from the OffsetTable of radius (see OffsetTable.shadows), so radius
+        must be given."""
+        self.stats=FOVStats()
+        (x,y)=(me[0],me[1])
+        (inside, blocking, beyond)=([], [], [])
+        radius_2=radius*radius
+        if world:
+            width=max([i[0] for i in world])-min([i[0] for i in world])
+            height=max([i[1] for i in world])-min([i[1] for i in world])
+        else:
+            width, height=0, 0
+        table=OffsetTable.get(width, height, radius)
+        for i in world:
+            (dx,dy)=(i[0]-x,i[1]-y)
+            d_2=dx*dx+dy*dy-dx*dy
+            if d_2>radius_2:
+                beyond.append(((i[0],i[1]),1.0,d_2))
+            else:
+                inside.append((dx,dy))
+                blocking.append(bool(i[2]))
+        inside=table.positions(inside)
+        (neighbors, starts, positions, lefts, rights)=table.shadows()
+        size=len(table)
+        blocks=zeros(size+1, dtype=bool) #the last one stands for the neighbors outside the table
+        blocks[inside]=blocking
+        cast=zeros((size, 4), dtype=bool)
+        cast[:,0]=blocks[:size]&~blocks[neighbors].all(axis=1) #buried loci are in shadow
+        cast[:,1:]=cast[:,0:1]&blocks[neighbors[:,0:3]]
+        cast=flatnonzero(cast)
+        (first, lengths)=(starts[cast], starts[cast+1]-starts[cast])
+        total=int(lengths.sum())
+        overlaid=arange(total)+repeat(first-cumsum(lengths)+lengths, lengths) #the entries of every shadow cast, in turn
+        (left, right)=(zeros(size), zeros(size))
+        if total:
+            overlaid=overlaid[positions[overlaid].argsort(kind='mergesort')]
+            at=positions[overlaid]
+            groups=concatenate(([0], flatnonzero(at[1:]!=at[:-1])+1)) #where each position's entries start
+            left[at[groups]]=maximum.reduceat(lefts[overlaid], groups)
+            right[at[groups]]=maximum.reduceat(rights[overlaid], groups)
+        covers=minimum(left+right, 1.0)
+        covers[0]=0.0 #an object cannot provide cover for itself
+        if fov is not None and facing is not None:
+            (cone, culled)=table.cone(facing, fov)
+            ids=table.positions(cone.keys())
+            covers[ids]=maximum(covers[ids], minimum([c[0]+c[1] for c in cone.itervalues()], 1.0))
+        (xs, ys, cs, ds)=(table.offsets[inside,0]+x, table.offsets[inside,1]+y, covers[inside], table.d_2[inside])
+        self.stats.loci+=int((ds>0).sum())
+        self.stats.covers+=total
+        self.stats.pairs+=len(cast)
+        if out is None:
+            return zip(zip(xs.tolist(), ys.tolist()), cs.tolist(), ds.tolist())+beyond
+        (out[0][xs, ys], out[1][xs, ys])=(cs, ds)
+        for (loc, c, d) in beyond:
+            (out[0][loc], out[1][loc])=(c, d)
+        return out
+
+    def approximationError(self, me, world, fov=None, facing=None, radius=None):
+        """Returns how far the approximate Field of View is from the one hexFOVGenerator calculates, as the mean and the
+        largest absolute difference in cover, and the number of tiles visible in one but not in the other.  There is no
+        approximation, and so no error, without a radius."""
+        if radius is None:
+            return (0.0, 0.0, 0)
+        approximate=dict([(r[0], r[1]) for r in self._approximateHexFOV(me, world, fov, facing, radius)])
+        result=None
+        for result in FOV(exact=self.exact).hexFOVGenerator(me, world, fov, facing, yield_each_iteration=False, radius=radius):
+            pass
+        errors=[(abs(approximate[r[0]]-r[1]), (approximate[r[0]]<1)!=(r[1]<1)) for r in result[0]]
+        if not errors:
+            return (0.0, 0.0, 0)
+        return (sum([e[0] for e in errors])/len(errors), max([e[0] for e in errors]), sum([e[1] for e in errors]))
+
+    def currentHexFOV(self):
+        """Returns the loci processed so far by the running, or last, hexFOVGenerator in the form calculateHexFOV does."""
+        if self._progress is None:
+            return []
+        (ret, me)=self._progress
+        return [((i.id[0]+me[0], i.id[1]+me[1]), min(i.cover_right+i.cover_left,1.0), i.d_2) for i in ret]
+
+    def coverBetween(self, a, b, world, fov=None, facing=None, radius=None):
+        """Returns the cover of tile b=(x,y) as seen from a=(x,y,blocksLOS), the same as calculateHexFOV would.
+
+        Loci that do not block line of sight cannot alter linepairs, so only the blocking loci visited before b are
+        processed, ring by ring, stopping as soon as b is certain to be fully covered, by the view cone or by shadows."""
+        self.stats=FOVStats()
+        (x,y)=(a[0],a[1])
+        offset=(b[0]-x,b[1]-y)
+        d_2=offset[0]*offset[0]+offset[1]*offset[1]-offset[0]*offset[1]
+        if not d_2:
+            return 0.0 #an object cannot provide cover for itself
+        if radius is not None and d_2>radius*radius:
+            return 1.0
+        blocks={}
+        for i in world:
+            blocks[i[0]-x,i[1]-y]=i[2]
+        width=max([i[0] for i in world])-min([i[0] for i in world])
+        height=max([i[1] for i in world])-min([i[1] for i in world])
+        table=OffsetTable.get(width, height, radius)
+        cone=None
+        if fov is not None and facing is not None:
+            (cone, culled)=table.cone(facing, fov)
+            if offset in culled:
+                return 1.0
+        p=table.position(offset)
+        target=table._loci(ar([p]), [blocks[offset]])[0]
+        positions=table.positions([o for (o, w) in blocks.iteritems() if w])
+        positions.sort()
+        positions=positions[(positions>0)&(positions<p)] #neither the origin nor beyond radius
+        rings=[] #blocking loci visited before b, grouped by distance
+        for l in table._loci(positions, [True]*len(positions)):
+            if not rings or rings[-1][0].d_2!=l.d_2:
+                rings.append([])
+            rings[-1].append(l)
+        last=rings.pop() if rings and rings[-1][0].d_2==d_2 else []
+        last.append(target)
         linepairs=[]
+        ret=[]
+        d_2=0
+        for loci in rings+[last]:
+            if [lp for lp in linepairs if lp[0].is_world or lp[0].calculateCover(target)[0]==1]:
+                self.stats.covers+=len(linepairs)
+                return 1.0
+            self.stats.covers+=len(linepairs)
+            for ignored in self._sweep(loci[::-1], ret, linepairs, a, False, d_2):
+                pass
+            d_2=loci[0].d_2
+        if cone is not None:
+            self._processInitialFOV([target], cone)
+        return min(target.cover_right+target.cover_left,1.0)
+
+    def coversToward(self, target, world, observers, radius=None, exposed=None):
+        """Returns the cover target=(x,y,blocksLOS) has from each of observers, ((x,y), fov, facing) triples with fov and
+        facing as for calculateHexFOV, as a list in the same order.
+
+        Cover is measured from the center of the observer's tile to the extent of the target's, so it is not symmetric,
+        and a sweep rooted at the target can be wrong either way, even about whether it is seen at all.  Each observer
+        sweeps from its own end instead, but only over the blocking loci no further away than the target, stopping as soon
+        as the target is certain to be fully covered."""
+        self.stats=FOVStats()
+        (x,y)=(target[0],target[1])
+        blocks=dict([((i[0],i[1]),i[2]) for i in world])
+        blocking=[(i[0],i[1]) for i in world if i[2]]
+        width=max([i[0] for i in world])-min([i[0] for i in world])
+        height=max([i[1] for i in world])-min([i[1] for i in world])
+        table=OffsetTable.get(width, height, radius)
+        covers=[]
+        for (origin, fov, facing) in observers:
+            offset=(x-origin[0],y-origin[1])
+            d_2=offset[0]*offset[0]+offset[1]*offset[1]-offset[0]*offset[1]
+            (cone, culled)=table.cone(facing, fov) if fov is not None and facing is not None else (None, None)
+            if not d_2: #an object cannot provide cover for itself
+                covers.append(0.0)
+            elif (radius is not None and d_2>radius*radius) or (cone is not None and offset in culled):
+                covers.append(1.0)
+            else:
+                l=self._sweepTargets((origin[0],origin[1]), [offset], blocks, blocking, table, exposed)[offset]
+                if cone is not None:
+                    self._processInitialFOV([l], cone)
+                covers.append(min(l.cover_right+l.cover_left,1.0))
+        return covers
+
+    def coverMatrix(self, world, observers, radius=None, exposed=None):
+        """Returns an N x N array whose [i,j] element is the cover observers[j] has from observers[i], for observers as in
+        coversToward, as calculateHexFOV from observers[i] would report it.
+
+        Line of sight is not symmetric, since cover is measured from the center of one tile to the extent of the other, so
+        every pair is looked at from both ends: one sweep per observer, processing only the blocking loci out to the
+        farthest of the others."""
+        self.stats=FOVStats()
+        n=len(observers)
+        covers=zeros((n,n))
+        blocks=dict([((i[0],i[1]),i[2]) for i in world])
+        blocking=[(i[0],i[1]) for i in world if i[2]]
+        width=max([i[0] for i in world])-min([i[0] for i in world])
+        height=max([i[1] for i in world])-min([i[1] for i in world])
+        table=OffsetTable.get(width, height, radius)
+        cones=[]
+        for (origin, fov, facing) in observers:
+            cones.append(table.cone(facing, fov) if fov is not None and facing is not None else (None, None))
+        for i in xrange(n):
+            (x,y)=observers[i][0]
+            (cone, culled)=cones[i]
+            targets={}
+            for j in xrange(n):
+                offset=(observers[j][0][0]-x, observers[j][0][1]-y)
+                d_2=offset[0]*offset[0]+offset[1]*offset[1]-offset[0]*offset[1]
+                if not d_2: #an object cannot provide cover for itself
+                    covers[i,j]=0.0
+                elif (radius is not None and d_2>radius*radius) or (cone is not None and offset in culled):
+                    covers[i,j]=1.0
+                else:
+                    targets.setdefault(offset, []).append(j)
+            found=self._sweepTargets((x,y), targets.keys(), blocks, blocking, table, exposed)
+            for (offset, others) in targets.iteritems():
+                l=found[offset]
+                if cone is not None:
+                    self._processInitialFOV([l], cone)
+                for j in others:
+                    covers[i,j]=min(l.cover_right+l.cover_left,1.0)
+        return covers
+
+    def _sweepTargets(self, origin, targets, blocks, blocking, table, exposed=None):
+        """Sweeps from origin=(x,y) over the blocking loci no further away than the farthest of targets, offsets from
+        origin, and returns a dict of the target loci by offset, holding the cover shadows alone provide them.
+
+        blocking lists the (x,y) locations that block line of sight, so that only those have to be looked up in table.  The
+        sweep goes ring by ring in growing batches, between which the farthest targets left are dropped, along with the loci
+        beyond those left, once certain to be fully covered."""
+        if not targets:
+            return {}
+        (x,y)=origin
+        positions=table.positions(targets)
+        d_max=table.d_2[positions].max()
+        walls=table.positions([(b[0]-x,b[1]-y) for b in blocking])
+        walls=walls[walls>0] #-1 if beyond radius, hence beyond every target
+        positions=sorted(set(positions.tolist())|set(walls[table.d_2[walls]<=d_max].tolist()))
+        loci=table._loci(ar(positions, dtype=int32), [blocks[o[0]+x,o[1]+y] for o in table.offsets[positions].tolist()])
+        found=dict([(l.id, l) for l in loci])
+        far=sorted([found[t] for t in targets]) #targets not yet processed, the farthest last
+        linepairs=[]
+        ret=[]
+        (start, d_2)=(0, 0)
+        while start<len(loci):
+            end=min(start+max(16,start/2), len(loci))
+            while end<len(loci) and loci[end].d_2==loci[end-1].d_2:
+                end+=1
+            for ignored in self._sweep(loci[end-1:start-1 if start else None:-1], ret, linepairs, origin, False, d_2, exposed=exposed):
+                pass
+            (start, d_2)=(end, loci[end-1].d_2)
+            far=[t for t in far if t.d_2>d_2]
+            while far and [lp for lp in linepairs if lp[0].is_world or lp[0].calculateCover(far[-1])[0]==1]:
+                self.stats.covers+=len(linepairs)
+                far.pop().cover_right=1.0 #certain to be fully covered, as in coverBetween
+                while loci and loci[-1].d_2>(far[-1].d_2 if far else d_2):
+                    loci.pop()
+        return dict([(t, found[t]) for t in targets])
+
+    def isCurrent(self, me, fov=None, facing=None, radius=None):
+        """Whether updateHexFOV can bring the last Field of View, calculated with the same parameters, up to date."""
+        snapshot=self._snapshot
+        if snapshot is None:
+            return False
+        return (snapshot.me[0],snapshot.me[1])==(me[0],me[1]) and (snapshot.fov,snapshot.facing,snapshot.radius)==(fov,facing,radius)
+
+    def updateHexFOV(self, changed, exposed=None, out=None):
+        """Recalculates the last Field of View after the tiles in changed, triples of the form (x,y,blocksLOS), had their
+        blocksLOS altered; exposed and out are as for calculateHexFOV, and exposed has to be up to date with the changes.
+
+        Requires an incremental FOV.  The sweep is resumed from the nearest changed tile's distance, and only loci in the
+        angular sectors the changes can affect are recomputed, as long as no reflex RayPair is involved."""
+        self.stats=FOVStats()
+        snapshot=self._snapshot
+        assert snapshot is not None, 'no Field of View to update'
+        (x,y)=(snapshot.me[0],snapshot.me[1])
+        blocks=snapshot.blocks
+        dirty=_DirtySectors(snapshot)
+        d_min=None
+        for i in changed:
+            offset=(i[0]-x,i[1]-y)
+            if offset not in blocks or bool(blocks[offset])==bool(i[2]):
+                continue
+            blocks[offset]=i[2]
+            d_2=offset[0]*offset[0]+offset[1]*offset[1]-offset[0]*offset[1]
+            if d_2: #the origin never blocks line of sight
+                dirty.add(Locus((offset[0],offset[1],i[2])))
+                d_min=d_2 if d_min is None else min(d_min, d_2)
+        if d_min is not None:
+            (index, linepairs)=snapshot.checkpoints[d_min]
+            ret=snapshot.visited[:index]
+            loci=snapshot.table.loci(blocks, d_min)
+            linepairs=[[lp,0] for lp in linepairs]
+            for ignored in self._sweep(loci, ret, linepairs, snapshot.me, False, d_min-1, snapshot.checkpoints, dirty, snapshot.culled, exposed):
+                pass
+            if snapshot.cone is not None:
+                self._processInitialFOV(ret[index:] if dirty.processed is None else dirty.processed, snapshot.cone)
+            snapshot.update(ret, linepairs)
+        if out is not None:
+            return self._writeArrays(snapshot.visited, snapshot.me, snapshot.beyond, out)
+        return [((i.id[0]+x, i.id[1]+y), min(i.cover_right+i.cover_left,1.0), i.d_2) for i in snapshot.visited]+snapshot.beyond
+
+    def _sweep(self, loci, ret, linepairs, me, yield_each_iteration, d_2=0, checkpoints=None, dirty=None, culled=None, exposed=None):
+        """Processes loci, popped from the end of the list, against linepairs and appends them to ret.
+
+        If checkpoints is given, the linepairs present at the start of each ring are recorded in it by d_2, along with the
+        number of loci processed so far; linepairs are copied before being altered so that the recorded ones stay intact.
+        If dirty sectors are given, loci that neither block line of sight nor touch them keep their previous cover.
+        If culled cone covers are given, loci they cover fully are only processed if they block line of sight, since
+        loci that do not cannot alter linepairs.
+        If exposed is given, blocking loci not in it whose nearer neighbors have all been found fully covered are fully
+        covered as well, and lie entirely within shadows already cast, so they are skipped.
+
+        linepairs are kept sorted clockwise alongside their keys, so that the search for the linepair(s) covering a locus
+        starts at the one its angle bisects to rather than walking around from the previous locus.
+
+        Events go to the tracer only if it is not a plain Tracer, and the work done is added to stats."""
+        raypair=ExactRayPair if self.exact else RayPair
+        tracer=self.tracer if self.tracer.__class__ is not Tracer else None
+        stats=self.stats
+        (start, tested, swept)=(len(ret), 0, 0) #the cover tests of single loci, and the loci tested against linepairs
+        streamed=start #loci of ret up to streamed have been yielded, if yield_each_iteration
+        linepairs.sort()
+        keys=[_clockwiseKey(lp[0].right[0]) for lp in linepairs]
         len_linepairs=len(linepairs)
-        if len_linepairs:
-            linepairs.sort()
-            linepairs=[[l,0] for l in linepairs] #adding the 'freshness' metric
-            #freshness affects whether the line(s) actually provide cover or are only considered as neighbors to blocking loci
-            #freshness can be 1 (left is fresh), 2 (right is fresh), 3 (both), or 0 (neither), hence initially all lines are 'stale'
-        #process everything else
-        d_2=1
-        lp_index=0 #start with the 'leftmost' linepair again
+        lp_index=0
+        ring=[] #covers of the current ring against linepairs, computed in bulk when no locus in it can alter linepairs
+        altered=True #whether linepairs may have changed since reflexes and wc were counted
+        covered=set() #offsets of the blocking loci found fully covered, if exposed is given
         while True:
-            assert sum([lp[0].is_reflex for lp in linepairs])<2, 'sum>=2'
-            wc=sum([lp[0].is_world for lp in linepairs])
-            if wc:
-                if len_linepairs!=1:
-                    logger.error(str(wc)+' '+str(len_linepairs)+' '+str(len(linepairs)))
-                    for lp in linepairs:
-                        logger.error(str(lp[0]))
-                    raise AssertionError("More than one linepair when world linepair exists.")
+            if yield_each_iteration and loci and len(ret)>streamed: #every path that assigns cover streams its locus here
+                yield ([((i.id[0]+me[0], i.id[1]+me[1]), min(i.cover_right+i.cover_left,1.0), i.d_2) for i in ret[streamed:]],loci[-1].id)
+                streamed=len(ret)
+            if altered:
+                reflexes=sum([lp[0].is_reflex for lp in linepairs])
+                assert reflexes<2, 'sum>=2'
+                wc=sum([lp[0].is_world for lp in linepairs])
+                if wc:
+                    if len_linepairs!=1:
+                        logger.error(str(wc)+' '+str(len_linepairs)+' '+str(len(linepairs)))
+                        for lp in linepairs:
+                            logger.error(str(lp[0]))
+                        raise AssertionError("More than one linepair when world linepair exists.")
+                altered=False
             try:
                 l=loci.pop()
             except IndexError:
                 break
-            if logger.level==logging.DEBUG:
-                logger.debug(str(l)+' '+str(len_linepairs))
-                logger.debug('------------------')
-                logger.debug('current linepairs:')
-                for linepair in linepairs:
-                    logger.debug(str(linepair))
-                logger.debug('------------------')
+            if dirty is not None and (reflexes or wc or len(ret)>=dirty.reflex_at):
+                (dirty.processed, dirty)=(None, None) #reflex linepairs are not bound to sectors
+            if wc: #enclosed, so the world linepair fully covers every remaining locus
+                loci.append(l)
+                while loci:
+                    l=loci.pop()
+                    if l.d_2 > d_2:
+                        d_2=l.d_2
+                        if checkpoints is not None:
+                            checkpoints[d_2]=(len(ret),[x[0] for x in linepairs])
+                    if culled and not l.blocksLOS and l.id in culled:
+                        (l.cover_left, l.cover_right)=culled[l.id]
+                    else:
+                        l.cover_right=1.0
+                    ret.append(l)
+                    if tracer:
+                        tracer.coverAssigned(l)
+                    if yield_each_iteration and loci:
+                        yield ([((l.id[0]+me[0], l.id[1]+me[1]), min(l.cover_right+l.cover_left,1.0), l.d_2)],loci[-1].id)
+                break
+            if tracer:
+                tracer.locusProcessed(l, linepairs)
             if l.d_2 > d_2:
                 d_2=l.d_2
-                lp_index=0 #restarting
                 for x in linepairs:
                     x[1]=0 #distance increase means all lines are now 'stale'
+                if checkpoints is not None:
+                    checkpoints[d_2]=(len(ret),[x[0] for x in linepairs])
+                if dirty is not None:
+                    dirty.ring=False
+                ring=[]
+                if dirty is None and len_linepairs and not l.blocksLOS:
+                    ring_loci=[l]
+                    for other in reversed(loci):
+                        if other.d_2!=d_2 or other.blocksLOS:
+                            break
+                        ring_loci.append(other)
+                    complete=len(ring_loci)==len(loci)+1 or loci[-len(ring_loci)].d_2!=d_2
+                    if culled:
+                        ring_loci=[other for other in ring_loci if other.id not in culled]
+                    if complete and len(ring_loci)>=FOV.BATCH_SIZE:
+                        ring=raypair.calculateCovers([lp[0] for lp in linepairs], ring_loci)
+                        ring.reverse()
+                        stats.covers+=len_linepairs*len(ring_loci)
+            if culled and not l.blocksLOS and l.id in culled and (dirty is None or not dirty.previous[l.id].blocksLOS):
+                (l.cover_left, l.cover_right)=culled[l.id]
+                ret.append(l)
+                if tracer:
+                    tracer.coverAssigned(l)
+                continue
+            if exposed is not None and l.blocksLOS and dirty is None and (l.id[0]+me[0],l.id[1]+me[1]) not in exposed:
+                (i,j)=l.id
+                for n in HEX_NEIGHBORS:
+                    (a,b)=(i+n[0],j+n[1])
+                    if a*a+b*b-a*b<l.d_2 and (a,b) not in covered:
+                        break
+                else:
+                    l.cover_right=1.0
+                    covered.add(l.id)
+                    ret.append(l)
+                    if tracer:
+                        tracer.coverAssigned(l)
+                    continue
+            covers=ring.pop() if ring else None
+            if dirty is not None and not dirty.ring and not l.blocksLOS and not dirty.previous[l.id].blocksLOS and not dirty.touches(l):
+                ret.append(dirty.previous[l.id])
+                if tracer:
+                    tracer.coverAssigned(dirty.previous[l.id])
+                continue
+            swept+=1
             processed=False
             direction=0
             line1=None
+            if len_linepairs:
+                lp_index=bisect_left(keys, l.key)%len_linepairs #the first linepair whose right ray is clockwise of l
             for ignored in xrange(len_linepairs):
                 (lp1, fresh1)=linepairs[lp_index]
-                (cover1, line1) = lp1.calculateCover(l)
-                if logger.level==logging.DEBUG:
-                    logger.debug('lp1 ['+str(lp_index)+']: '+str(lp1))
-                    logger.debug('fresh1: '+str(fresh1)+' cover1: '+str(cover1)+' line1: '+str(line1))
+                if covers:
+                    (cover1, line1)=covers[lp_index]
+                else:
+                    (cover1, line1)=lp1.calculateCover(l)
+                    tested+=1
                 if line1==3: #either reflex angle intersecting same locus from two different sides, or result of circle being > unit
                     (cover1,cover2)=(cover1[0],cover1[1])
                     l.cover_right=max(cover1,0.0)*(not fresh1&1)
                     l.cover_left=max(cover2,0.0)*(not fresh1&2)
                     if l.blocksLOS and lp1.is_reflex:
+                        if checkpoints is not None:
+                            lp1=linepairs[lp_index][0]=lp1.copy()
                         lp1.is_world = True
                     processed=True
                     break
@@ -376,19 +1381,18 @@ class FOV(object):
                 (lp2,fresh2,cover2,line2)=(None,0,-1,0)
                 if cover1>=0: #jackpot?
                     if len_linepairs>1:
+                        other=None
                         if line1==1 and direction!=1:
-                            if logger.level==logging.DEBUG:
-                                debug_index=(lp_index-1)%len_linepairs
-                            (lp2, fresh2)=linepairs[(lp_index-1)%len_linepairs]
-                            (cover2, line2) = lp2.calculateCover(l)
+                            other=(lp_index-1)%len_linepairs
                         elif direction!=-1: #line1==2
-                            if logger.level==logging.DEBUG:
-                                debug_index=(lp_index-1)%len_linepairs
-                            (lp2, fresh2)=linepairs[(lp_index+1)%len_linepairs]
-                            (cover2, line2) = lp2.calculateCover(l)
-                        if logger.level==logging.DEBUG:
-                            logger.debug('lp2: ['+str(debug_index)+']'+str(lp2))
-                            logger.debug('fresh2: '+str(fresh2)+' cover2: '+str(cover2)+' line2: '+str(line2))
+                            other=(lp_index+1)%len_linepairs
+                        if other is not None:
+                            (lp2, fresh2)=linepairs[other]
+                            if covers:
+                                (cover2, line2)=covers[other]
+                            else:
+                                (cover2, line2)=lp2.calculateCover(l)
+                                tested+=1
                         if cover2>=0 and line2==line1:
                             logger.error(str(me))
                             logger.error('locus: '+str(l))
@@ -405,19 +1409,32 @@ class FOV(object):
                         l.cover_right=max(cover2,0.0)*(not fresh2&line2)
                     if l.blocksLOS:
                         if cover2>=0:
-                            lp=RayPair.mergePairsByLocus((lp1, line1), (lp2, line2))
-                            if logger.level<=logging.INFO:
-                                lp.culprits.append(l)
+                            lp=raypair.mergePairsByLocus((lp1, line1), (lp2, line2))
+                            stats.merges+=1
+                            if tracer:
+                                tracer.pairMerged(lp, l, (lp1, lp2))
                             linepairs[lp_index]=[lp,fresh1|fresh2]
-                            if line1==1:
-                                linepairs.pop((lp_index-1)%len_linepairs)
-                            else:
-                                linepairs.pop((lp_index+1)%len_linepairs)
+                            keys[lp_index]=_clockwiseKey(lp.right[0])
+                            other=(lp_index+(-1 if line1==1 else 1))%len_linepairs
+                            linepairs.pop(other)
+                            keys.pop(other)
                             len_linepairs-=1
-                            lp_index=(lp_index-1)%len_linepairs
+                            if line1==2 and not other: #merged across the start, taking over the first right ray
+                                linepairs.insert(0, linepairs.pop())
+                                keys.insert(0, keys.pop())
                         else:
+                            if checkpoints is not None:
+                                lp1=linepairs[lp_index][0]=lp1.copy()
                             lp1.mergeLocus(l, line1)
+                            stats.merges+=1
+                            if tracer:
+                                tracer.pairMerged(lp1, l, (lp1,))
                             linepairs[lp_index][1]|=line1
+                            if line1==2:
+                                keys[lp_index]=l.key
+                                if lp_index and lp_index==len_linepairs-1 and keys[lp_index]<keys[lp_index-1]: #grew across the start
+                                    linepairs.insert(0, linepairs.pop())
+                                    keys.insert(0, keys.pop())
                     processed=True
                     break #if cover1>=0
                 if not direction:
@@ -429,36 +1446,49 @@ class FOV(object):
                     break
                 lp_index=(lp_index+direction)%len_linepairs
             if not processed and l.blocksLOS:
-                linepairs.append([l.toRayPair(),3])
+                index=bisect_right(keys, l.key)
+                linepairs.insert(index, [raypair.fromLocus(l),3])
+                stats.pairs+=1
+                if tracer:
+                    tracer.pairCreated(linepairs[index][0], l)
+                keys.insert(index, l.key)
                 len_linepairs+=1
-                linepairs.sort()
             ret.append(l)
-            if yield_each_iteration:
-                (x,y)=(me[0],me[1])
-                try:
-                    next_locus = loci[-1]
-                    yield ([((i.id[0]+x, i.id[1]+y), min(i.cover_right+i.cover_left,1.0), i.d_2) for i in ret],next_locus.id)
-                except IndexError:
-                    pass
-        (x,y)=(me[0],me[1])
-        logger.debug("RayPairs processed: "+str(RayPair.count_processed))
-        if fov is not None and facing is not None:
-            self._processInitialFOV(ret, facing, fov)
-        yield ([((i.id[0]+x, i.id[1]+y), min(i.cover_right+i.cover_left,1.0), i.d_2) for i in ret],None)
+            if tracer:
+                tracer.coverAssigned(l)
+            altered=altered or l.blocksLOS
+            if exposed is not None and l.blocksLOS and l.cover_right+l.cover_left>=1.0:
+                covered.add(l.id)
+            if dirty is not None:
+                if (l.blocksLOS or dirty.previous[l.id].blocksLOS) and dirty.touches(l):
+                    dirty.add(l)
+                    dirty.ring=True #merges spread freshness over whole linepairs, so the rest of the ring may differ anywhere
+                dirty.processed.append(l)
+        stats.loci+=swept
+        stats.covers+=tested
 
 if __name__ == '__main__':
     import unittest
     import copy
+    import os
     from sys import argv
     from getopt import getopt, GetoptError
+    from math import ceil
 
     def usage():
         print "Usage: "
         print ""
         print '\t'+argv[0]+' -h|--help'
         print '\t'+argv[0]+' [-u|--unit] [<test> ...]'
-        print '\t'+argv[0]+' -r|--regression [-s|--seeds <X>[-<Y>]] [-g|--geometry <W>x<H>]'
+        print '\t'+argv[0]+' -r|--regression [-x|--exact] [-a|--approximate] [-d|--radius <R>] [-s|--seeds <X>[-<Y>]] [-g|--geometry <W>x<H>]'
         print '\t'+argv[0]+' -t|--step-through -s|--seeds <X>'
+        print '\t'+argv[0]+' -b|--benchmark [-x|--exact] [-a|--approximate] [-d|--radius <R>] [-n|--observers <N>] [-o|--output <file>] [-c|--compare <file>]'
+        print ""
+        print "FOV only approximates within a radius."
+
+    def percentile(values, p):
+        """Returns the nearest-rank p-th quantile, 0<p<=1, of a sorted list."""
+        return values[max(0, int(ceil(p*len(values)))-1)]
 
     class FOVTest(unittest.TestCase):
         """Performs a series of tests by running FOV's calculateHexFOV function on a 5x5 world with different scenarios."""
@@ -475,6 +1505,12 @@ if __name__ == '__main__':
                     ]
             self.almost_cover=-SQRT3_4+1 #tile edge shaving
 
+        def _loadMap(self, name):
+            """Returns the world of maps/<name>.txt, in which '#' marks the tiles that block line of sight."""
+            path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps', name+'.txt')
+            rows=[line.rstrip('\n') for line in open(path) if line.strip()]
+            return [(i,j,c=='#') for (j,row) in enumerate(rows) for (i,c) in enumerate(row)]
+
         def _checkResult(self, result, *args):
             """Verifies that the tiles returned have correct cover.
             Accepts the result of calculateHexFOV as the first parameter, followed by location_tuples, cover_value in unpacked form.
@@ -717,14 +1753,287 @@ if __name__ == '__main__':
             res=self.fov.calculateHexFOV(me,world)
             self._checkResult(res,[(1,1),(1,2),(2,1),(2,2),(2,3),(3,2),(3,3),(4,0),(4,1),(4,2)],0,[(3,0),(3,1),(4,3)],self.almost_cover,None,1)
 
+        def test24_Radius(self):
+            """Limiting sight radius to one tile"""
+            me=(2,2)
+            world=copy.deepcopy(self.base_world)
+            world[13][2]=1 #(3,2) E
+            res=self.fov.calculateHexFOV(me,world,radius=1)
+            self.assertEqual(len(res),len(world))
+            self._checkResult(res,[(2,2),(3,2),(3,3),(2,3),(1,2),(1,1),(2,1)],0,None,1)
+            bounded=dict([(r[0],r) for r in self.fov.calculateHexFOV(me,world,radius=2)])
+            for r in self.fov.calculateHexFOV(me,world):
+                if r[2]<=4:
+                    self.assertEqual(bounded[r[0]],r)
+
+        def test25_BatchCover(self):
+            """Comparing batch cover evaluation against individual RayPairs"""
+            loci=[Locus((i[0]-2,i[1]-2,i[2])) for i in self.base_world if (i[0],i[1])!=(2,2)]
+            raypairs=[Locus((1,0,True)).toRayPair(), Locus((-1,-1,True)).toRayPair(), rayPairFromFF((1,1),pi/1.5), rayPairFromFF((0,1),pi/3)]
+            merged=Locus((0,1,True)).toRayPair()
+            merged.mergeLocus(Locus((-1,0,True)), 1)
+            raypairs.append(merged)
+            world=Locus((0,-1,True)).toRayPair()
+            world.is_world=True
+            raypairs.append(world)
+            rows=RayPair.calculateCovers(raypairs, loci)
+            for (l, row) in zip(loci, rows):
+                self.assertEqual(row, [lp.calculateCover(l) for lp in raypairs])
+
+        def test26_Incremental(self):
+            """Updating Field of View after walls appear and disappear"""
+            from random import Random
+            random=Random(0)
+            me=(6,6)
+            world=[[i,j,int(random.random()<0.2)] for i in xrange(13) for j in xrange(13)]
+            world[6*13+6][2]=0
+            incremental=FOV(incremental=True)
+            for (fov,facing) in ((None,None),(pi/1.5,(0,1))):
+                incremental.calculateHexFOV(me,world,fov,facing)
+                self.assertTrue(incremental.isCurrent(me,fov,facing))
+                for step in xrange(10):
+                    changed=[]
+                    for i in random.sample(xrange(len(world)),2):
+                        if (world[i][0],world[i][1])!=me:
+                            world[i][2]=1-world[i][2]
+                            changed.append(tuple(world[i]))
+                    self.assertEqual(sorted(incremental.updateHexFOV(changed)),sorted(self.fov.calculateHexFOV(me,world,fov,facing)))
+
+        def test27_ClockwiseKey(self):
+            """Ordering RayPairs by key the same way as by comparison"""
+            points=[p for i in self.base_world if (i[0],i[1])!=(2,2) for p in (Locus((i[0]-2,i[1]-2,0)).n, Locus((i[0]-2,i[1]-2,0)).rays[1][0])]
+            self.assertEqual([tuple(p) for p in sorted(points, cmp=_clockwiseCompare)], [tuple(p) for p in sorted(points, key=_clockwiseKey)])
+
+        def test28_CoverBetween(self):
+            """Querying cover of single tiles the same as the whole Field of View"""
+            from random import Random
+            random=Random(1)
+            me=(6,6,0)
+            world=[(i,j,int(random.random()<0.25 and (i,j)!=(6,6))) for i in xrange(13) for j in xrange(13)]
+            for (fov,facing,radius) in ((None,None,None),(pi/1.5,(0,1),None),(None,None,4)):
+                for (loc,cover,d_2) in self.fov.calculateHexFOV(me,world,fov,facing,radius):
+                    self.assertEqual(self.fov.coverBetween(me,loc,world,fov,facing,radius),cover)
+
+        def test29_Streaming(self):
+            """Yielding each processed locus on its own"""
+            me=(2,2,0)
+            world=copy.deepcopy(self.base_world)
+            world[1*5+2][2]=1
+            streamed={}
+            for (result,next_id) in self.fov.hexFOVGenerator(me,world):
+                if next_id is None:
+                    break
+                streamed.update([(r[0],r) for r in result])
+                self.assertEqual(sorted(streamed.values()),sorted(self.fov.currentHexFOV()))
+            self.assertEqual(len(streamed),len(world)-1) #the last locus is only yielded with the whole Field of View
+            self.assertEqual(sorted(result),sorted(self.fov.calculateHexFOV(me,world)))
+            self.assertEqual(sorted(streamed.values()),sorted([r for r in result if r[0] in streamed]))
+            from random import Random
+            random=Random(1)
+            me=(6,6,0)
+            world=[[i,j,int(random.random()<0.3)] for i in xrange(13) for j in xrange(13)]
+            world[6*13+6][2]=0
+            blocks=dict([((w[0],w[1]),w[2]) for w in world])
+            exposed=set([loc for (loc,b) in blocks.iteritems() if b and [n for n in HEX_NEIGHBORS if not blocks.get((loc[0]+n[0],loc[1]+n[1]),0)]])
+            for kwargs in ({'fov':pi/1.5,'facing':(0,1)}, {'exposed':exposed}, {'fov':pi/1.5,'facing':(0,1),'exposed':exposed}):
+                streamed={}
+                for (result,next_id) in self.fov.hexFOVGenerator(me,world,**kwargs):
+                    if next_id is None:
+                        break
+                    streamed.update([(r[0],r) for r in result])
+                    self.assertEqual(sorted(streamed.values()),sorted(self.fov.currentHexFOV()))
+                self.assertEqual(len(streamed),len(world)-1) #culled and buried loci are streamed as well
+
+        def test30_Enclosed(self):
+            """Everything beyond two closed rings of walls"""
+            me=(4,4,0)
+            world=[[i,j,int(0<(i-4)**2+(j-4)**2-(i-4)*(j-4)<=4)] for i in xrange(9) for j in xrange(9)]
+            incremental=FOV(incremental=True)
+            for r in incremental.calculateHexFOV(me,world):
+                if r[2]>4:
+                    self._assertEqualCover(r,1)
+            world[3*9+4][2]=0
+            self.assertEqual(sorted(incremental.updateHexFOV([tuple(world[3*9+4])])),sorted(self.fov.calculateHexFOV(me,world)))
+
+        def test31_Buried(self):
+            """Skipping walls buried in rock"""
+            from random import Random
+            random=Random(1)
+            me=(6,6,0)
+            world=[[i,j,int(random.random()<0.6)] for i in xrange(13) for j in xrange(13)]
+            world[6*13+6][2]=0
+            blocks=dict([((w[0],w[1]),w[2]) for w in world])
+            exposed=set([loc for (loc,b) in blocks.iteritems() if b and [n for n in HEX_NEIGHBORS if not blocks.get((loc[0]+n[0],loc[1]+n[1]),0)]])
+            self.assertTrue(len(exposed)<sum(blocks.values()))
+            for (fov,facing) in ((None,None),(pi/1.5,(0,1))):
+                self.assertEqual(sorted(self.fov.calculateHexFOV(me,world,fov,facing,exposed=exposed)),sorted(self.fov.calculateHexFOV(me,world,fov,facing)))
+
+        def test32_CoversToward(self):
+            """Cover toward one tile from many observers"""
+            from random import Random
+            random=Random(2)
+            world=[[i,j,int(random.random()<0.2)] for i in xrange(13) for j in xrange(13)]
+            free=[(w[0],w[1]) for w in world if not w[2]]
+            cases=[(world, free[len(free)/2], [(o,None,None) for o in free[::5]]+[(o,pi/1.5,(0,1)) for o in free[2::5]])]
+            world=self._loadMap('cave_31x25') #line of sight is not symmetric here: (1,16) sees (10,9), which cannot see it
+            free=[(w[0],w[1]) for w in world if not w[2]]
+            for target in [(1,16)]+random.sample(free,3):
+                cases.append((world, target, [((10,9),None,None),((10,9),pi/1.5,(-1,0))]+[(o,None,None) for o in random.sample(free,8)]))
+            for (world, target, observers) in cases:
+                covers=self.fov.coversToward(target+(0,), world, observers)
+                for ((origin,fov,facing),cover) in zip(observers,covers):
+                    expected=dict([(r[0],r[1]) for r in self.fov.calculateHexFOV(origin+(0,),world,fov,facing)])[target]
+                    self.assertEqual(cover, expected)
+
+        def test33_CoverMatrix(self):
+            """Cover between every pair of many observers"""
+            from random import Random
+            random=Random(3)
+            world=[[i,j,int(random.random()<0.2)] for i in xrange(13) for j in xrange(13)]
+            free=[(w[0],w[1]) for w in world if not w[2]]
+            cases=[(world, [(o,None,None) for o in free[::7]]+[(o,pi/1.5,(1,1)) for o in free[3::7]]+[(free[0],pi/1.5,(-1,0))], radius) for radius in (None,4)]
+            world=self._loadMap('cave_31x25') #line of sight is not symmetric here: (1,16) sees (10,9), which cannot see it
+            free=[(w[0],w[1]) for w in world if not w[2]]
+            cases.append((world, [((1,16),None,None),((10,9),None,None)]+[(o,None,None) for o in random.sample(free,6)], None))
+            for (world, observers, radius) in cases:
+                covers=self.fov.coverMatrix(world, observers, radius)
+                for (i,(origin,fov,facing)) in enumerate(observers):
+                    expected=dict([(r[0],r[1]) for r in self.fov.calculateHexFOV(origin+(0,),world,fov,facing,radius)])
+                    for (j,other) in enumerate(observers):
+                        self.assertEqual(covers[i,j], expected[other[0]])
+            self.assertEqual((covers[0,1], covers[1,0]), (0.0, 1.0))
+
+        def test34_Exact(self):
+            """Exact arithmetic agrees with floating point"""
+            from random import Random
+            self.assertEqual(_sqrtSumSign(((1,2),(1,2),(-2,2))), 0)
+            self.assertEqual(_sqrtSumSign(((1,2),(1,3),(-1,10))), -1)
+            self.assertEqual(_sqrtSumSign(((1,2),(-1,3),(-1,1))), -1)
+            self.assertEqual(_sqrtSumSign(((-2,3),(1,12))), 0)
+            random=Random(4)
+            me=(6,6,0)
+            world=[[i,j,int(random.random()<0.25)] for i in xrange(13) for j in xrange(13)]
+            world[6*13+6][2]=0
+            exact=FOV(incremental=True, exact=True)
+            for (fov,facing) in ((None,None),(pi/1.5,(0,1))):
+                result=sorted(exact.calculateHexFOV(me,world,fov,facing))
+                for (r,expected) in zip(result,sorted(self.fov.calculateHexFOV(me,world,fov,facing))):
+                    self.assertEqual((r[0],r[2]),(expected[0],expected[2]))
+                    self.assertAlmostEqual(r[1], expected[1], 12)
+                changed=[]
+                for i in random.sample(xrange(len(world)),4):
+                    if (world[i][0],world[i][1])!=me[0:2]:
+                        world[i][2]=1-world[i][2]
+                        changed.append(tuple(world[i]))
+                self.assertEqual(sorted(exact.updateHexFOV(changed)),sorted(FOV(exact=True).calculateHexFOV(me,world,fov,facing)))
+
+        def test35_Approximate(self):
+            """Overlaid shadows match the sweep for lone loci and straight walls, and come close otherwise"""
+            from random import Random
+            me=(7,7,0)
+            approximate=FOV(approximate=True)
+            for walls in ([(10,7)], [(10,7),(10,8),(10,9)], [(4,9),(5,9),(6,9),(7,9)]):
+                world=[(i,j,(i,j) in walls) for i in xrange(15) for j in xrange(15)]
+                (mean, worst, flips)=approximate.approximationError(me,world,radius=8)
+                self.assertAlmostEqual(worst, 0.0, 12)
+                self.assertEqual(sorted([r[0] for r in approximate.calculateHexFOV(me,world,radius=8)]), sorted([r[0:2] for r in world]))
+            random=Random(2)
+            world=[(i,j,int(random.random()<0.2 and (i,j)!=me[0:2])) for i in xrange(15) for j in xrange(15)]
+            self.assertEqual(approximate.calculateHexFOV(me,world), FOV().calculateHexFOV(me,world)) #no radius, no approximation
+            for (fov,facing,radius) in ((None,None,8),(pi/1.5,(0,1),8),(None,None,4)):
+                (mean, worst, flips)=approximate.approximationError(me,world,fov,facing,radius)
+                self.assertTrue(mean<0.05)
+                self.assertTrue(flips<len(world)/10)
+
+        def test36_Arrays(self):
+            """Writing into arrays gives what is returned as a list"""
+            from random import Random
+            from numpy import empty
+            random=Random(6)
+            me=(5,6,0)
+            world=[[i,j,int(random.random()<0.25 and (i,j)!=me[0:2])] for i in xrange(11) for j in xrange(13)]
+            def check(result, out):
+                self.assertEqual(len(result), 11*13)
+                for (loc, cover, d_2) in result:
+                    self.assertEqual((out[0][loc], out[1][loc]), (cover, d_2))
+            for (fov,facing,radius) in ((None,None,None),(pi/1.5,(0,1),None),(None,None,4)):
+                for approximate in (False, True):
+                    out=(empty((11,13)), empty((11,13), dtype=int))
+                    fov_=FOV(approximate=approximate)
+                    self.assertTrue(fov_.calculateHexFOV(me,world,fov,facing,radius,out=out) is out)
+                    check(fov_.calculateHexFOV(me,world,fov,facing,radius), out)
+                incremental=FOV(incremental=True)
+                out=(empty((11,13)), empty((11,13), dtype=int))
+                incremental.calculateHexFOV(me,world,fov,facing,radius,out=out)
+                world[40][2]=1-world[40][2]
+                incremental.updateHexFOV([tuple(world[40])], out=out)
+                check(FOV().calculateHexFOV(me,world,fov,facing,radius), out)
+
+        def test37_Tracer(self):
+            """A tracer sees every locus and RayPair, changing nothing, and stats count the last call only"""
+            class Recorder(Tracer):
+                def __init__(self):
+                    (self.processed, self.created, self.merged, self.covered)=([], [], [], [])
+                def locusProcessed(self, locus, linepairs):
+                    self.processed.append(locus.id)
+                def pairCreated(self, raypair, locus):
+                    self.created.append(locus.id)
+                def pairMerged(self, raypair, locus, merged):
+                    self.merged.append((locus.id, len(merged)))
+                def coverAssigned(self, locus):
+                    self.covered.append(locus.id)
+            world=copy.deepcopy(self.base_world)
+            for (x,y) in ((3,2),(3,3),(1,1)):
+                world[x+5*y][2]=1
+            me=(2,2,0)
+            expected=self.fov.calculateHexFOV(me,world)
+            recorder=Recorder()
+            fov=FOV(tracer=recorder)
+            self.assertEqual(fov.calculateHexFOV(me,world), expected)
+            self.assertEqual(sorted(recorder.covered), sorted([(i-2,j-2) for (i,j,b) in world if (i,j)!=(2,2)]))
+            self.assertEqual(recorder.created, [(1,1),(-1,-1)])
+            self.assertEqual(recorder.merged, [((1,0),1)])
+            stats=fov.stats
+            self.assertEqual((stats.loci, stats.pairs, stats.merges), (24, 2, 1))
+            self.assertTrue(stats.covers>=len(recorder.processed)-1)
+            fov.calculateHexFOV(me,world,radius=1)
+            self.assertEqual(fov.stats.loci, 6)
+            fov.calculateHexFOV(me,world,pi/1.5,(1,0))
+            self.assertTrue(fov.stats.loci<24) #culled loci are not tested
+            approximate=FOV(approximate=True)
+            approximate.calculateHexFOV(me,world,radius=4)
+            self.assertEqual((approximate.stats.loci, approximate.stats.pairs, approximate.stats.merges), (24, 4, 0)) #three walls and one adjacent pair of them
+            self.assertEqual(self.fov.stats.pairs, 2)
+
+        def test38_Sampling(self):
+            """Any one or two loci around the observer cast the shadows the sampling reference finds, to within a sample"""
+            from itertools import combinations
+            from sampling import SamplingFOV
+            reference=SamplingFOV(17)
+            me=(2,2,0)
+            around=[(2+n[0],2+n[1]) for n in HEX_NEIGHBORS]
+            for blocking in [(a,) for a in around]+list(combinations(around, 2)):
+                world=[(i,j,int((i,j) in blocking)) for (i,j,b) in self.base_world]
+                expected=dict([(r[0], r[1]) for r in reference.calculateHexFOV(me,world)])
+                for (loc,cover,d_2) in self.fov.calculateHexFOV(me,world):
+                    self.assertAlmostEqual(cover, expected[loc], delta=1/16.0, msg=str(blocking)+' '+str(loc))
+
     (opts,args)=(None,None)
     unit=False
     regression=False
     step_through=False
+    benchmark=False
+    exact=False
+    approximate=False
+    radius=None
     seeds=(0,255)
     geometry=(25,25)
+    observers=50
+    output='benchmark.json'
+    compare=None
     try:
-        opts, args = getopt(argv[1:], "hurs:g:t", ['help','unit','regression','seeds','geometry','step-through'])
+        opts, args = getopt(argv[1:], "hurxad:s:g:tbn:o:c:", ['help','unit','regression','exact','approximate','radius=','seeds','geometry',
+            'step-through','benchmark','observers=','output=','compare='])
         for opt, arg in opts:
             if opt in ('-h','--help'):
                 usage()
@@ -733,6 +2042,12 @@ if __name__ == '__main__':
                 unit=True
             elif opt in ('-r','--regression'):
                 regression=True
+            elif opt in ('-x','--exact'):
+                exact=True
+            elif opt in ('-a','--approximate'):
+                approximate=True
+            elif opt in ('-d','--radius'):
+                radius=int(arg)
             elif opt in ('-s','--seeds'):
                 if '-' in arg:
                     seeds=arg.split('-')
@@ -743,11 +2058,19 @@ if __name__ == '__main__':
                 geometry=(int(geometry[0]),int(geometry[1]))
             elif opt in ('-t','--step-through'):
                 step_through=True
+            elif opt in ('-b','--benchmark'):
+                benchmark=True
+            elif opt in ('-n','--observers'):
+                observers=int(arg)
+            elif opt in ('-o','--output'):
+                output=arg
+            elif opt in ('-c','--compare'):
+                compare=arg
         if unit and regression and step_through:
             raise GetoptError
-        if not regression and not step_through:
+        if not regression and not step_through and not benchmark:
             unit=True
-    except GetoptError:
+    except (GetoptError, ValueError):
         usage()
         exit(1)
     if unit:
@@ -764,7 +2087,7 @@ if __name__ == '__main__':
 
         logger.setLevel(logging.INFO)
 
-        fov=FOV()
+        fov=FOV(exact=exact)
         errors=[]
         successes=0
         for seed in xrange(int(seeds[0]),int(seeds[1])+1):
@@ -780,8 +2103,11 @@ if __name__ == '__main__':
             tile=tiles[0]
             world=[(i,j,level[i,j].blocksLOS()) for i in xrange(level.width) for j in xrange(level.height)]
             me=(tile.loc[0],tile.loc[1],False)
+            if approximate:
+                (mean, worst, flips)=fov.approximationError(me,world,radius=radius)
+                print "\tapproximate cover error: mean "+str(mean)+" worst "+str(worst)+" visibility flips "+str(flips)
             try:
-                result=fov.calculateHexFOV(me,world)
+                result=fov.calculateHexFOV(me,world,radius=radius)
                 for item in result:
                     if item[1]>1:
                         raise AssertionError("cover > 1")
@@ -799,6 +2125,58 @@ if __name__ == '__main__':
         else:
             print str(successes)+" tests completed successfully."
             exit(0)
+    elif benchmark:
+        import os
+        import json
+        from glob import glob
+        from random import Random
+        from timeit import default_timer
+
+        fov=FOV(exact=exact, approximate=approximate)
+        results={'exact':exact, 'approximate':approximate, 'radius':radius, 'observers':observers, 'maps':{}}
+        for path in sorted(glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps', '*.txt'))):
+            name=os.path.basename(path)[:-len('.txt')]
+            rows=[line.rstrip('\n') for line in open(path) if line.strip()]
+            world=[(i,j,c=='#') for (j,row) in enumerate(rows) for (i,c) in enumerate(row)]
+            random=Random(0)
+            origins=[random.choice([(x,y) for (x,y,b) in world if not b]) for k in xrange(observers)]
+            print name+" ("+str(len(rows[0]))+"x"+str(len(rows))+")"
+            for facing in HEX_NEIGHBORS: #builds the OffsetTable and view cones before anything is timed
+                fov.calculateHexFOV((origins[0][0],origins[0][1],False), world, pi/1.5, facing, radius)
+            results['maps'][name]={}
+            for mode in ('full', 'cone'):
+                (times, pairs, loci)=([], [], [])
+                for (k,(x,y)) in enumerate(origins):
+                    (view, facing)=(pi/1.5, HEX_NEIGHBORS[k%6]) if mode=='cone' else (None, None)
+                    start=default_timer()
+                    fov.calculateHexFOV((x,y,False), world, view, facing, radius)
+                    times.append(default_timer()-start)
+                    (pairs, loci)=(pairs+[fov.stats.pairs], loci+[fov.stats.loci])
+                times.sort()
+                result={'median':percentile(times, 0.5), 'p95':percentile(times, 0.95), 'p99':percentile(times, 0.99),
+                        'pairs':sum(pairs)/float(len(pairs)), 'loci':sum(loci)/float(len(loci))}
+                results['maps'][name][mode]=result
+                print "\t%s: median %.2fms p95 %.2fms p99 %.2fms, %.1f RayPairs created and %.1f loci processed on average" % \
+                        (mode, result['median']*1000, result['p95']*1000, result['p99']*1000, result['pairs'], result['loci'])
+        f=open(output, 'w')
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.close()
+        print "results saved to "+output
+        if compare is not None:
+            f=open(compare)
+            baseline=json.load(f)
+            f.close()
+            print "compared to "+compare+" (new/old):"
+            for (name, modes) in sorted(results['maps'].iteritems()):
+                for (mode, result) in sorted(modes.iteritems()):
+                    try:
+                        old=baseline['maps'][name][mode]
+                    except KeyError:
+                        print "\t"+name+" "+mode+": not in "+compare
+                        continue
+                    print "\t%s %s: median x%.2f p95 x%.2f p99 x%.2f, RayPairs x%.2f, loci x%.2f" % (name, mode,
+                            result['median']/old['median'], result['p95']/old['p95'], result['p99']/old['p99'],
+                            result['pairs']/old['pairs'] if old['pairs'] else 1.0, result['loci']/old['loci'] if old['loci'] else 1.0)
     elif step_through:
         from random import Random
         import sys
@@ -835,6 +2213,7 @@ if __name__ == '__main__':
         worldview=HexGridView(level, perception)
         worldview.center(worldview[tile.loc].rect)
         worldview.draw()
+        perception.fov.tracer=LoggingTracer()
         for result in perception.fov.hexFOVGenerator(me, world):
             for r in result[0]:
                 perception[r[0][0],r[0][1]].d2=r[2]
@@ -13,6 +13,7 @@ class Context(object):
         self.screen_manager = None
         self.turn_manager = None
         self.message_buffer = None
+        self.fov_pool = None
     
     @classmethod
     def getContext(self):
@@ -21,7 +22,7 @@ class Context(object):
         return Context.ctx
     
     def __getstate__(self):
-        state=dict([(key,self.__dict__[key]) for key in self.__dict__.keys() if key not in ('worldview','screen_manager','message_buffer')])
-        for key in ('worldview','screen_manager','message_buffer'):
+        state=dict([(key,self.__dict__[key]) for key in self.__dict__.keys() if key not in ('worldview','screen_manager','message_buffer','fov_pool')])
+        for key in ('worldview','screen_manager','message_buffer','fov_pool'):
             state[key]=None
         return state
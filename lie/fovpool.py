@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# Copyright (c) 2012 Igor Kaplounenko.
+# Licensed under the Open Software License version 3.0.
+
+from multiprocessing import Pool, cpu_count
+from multiprocessing.sharedctypes import RawArray
+from numpy import frombuffer, int8, ones, zeros, maximum
+from math import pi
+import logging
+
+from asp_spa import FOV, OffsetTable
+
+__all__=['FOVPool']
+
+logger=logging.getLogger(__name__)
+
+PI_2 = pi*2
+
+#per-worker state, set up once by _initWorker
+_blocks=None
+_fov=None
+
+def _initWorker(grid, width, height):
+    global _blocks, _fov
+    _blocks=frombuffer(grid, dtype=int8).reshape((width,height))
+    _fov=FOV()
+
+def _getWorld(origin):
+    (width,height)=_blocks.shape
+    blocks=_blocks.tolist()
+    world=[(i,j,blocks[i][j]) for i in xrange(width) for j in xrange(height)]
+    return ((origin[0],origin[1],blocks[origin[0]][origin[1]]), world)
+
+def _calculateCover(args):
+    (origin, fov, facing, radius)=args
+    (me, world)=_getWorld(origin)
+    cover=ones(_blocks.shape)
+    for (loc,c,d_2) in _fov.calculateHexFOV(me, world, fov, facing, radius):
+        cover[loc]=c
+    return cover
+
+def _calculateSector(args):
+    (origin, fov, facing, radius, sector)=args
+    (me, world)=_getWorld(origin)
+    cover=zeros(_blocks.shape) #tiles of other sectors, to be merged by maximum
+    for (loc,c,d_2) in _fov.calculateHexFOV(me, world, fov, facing, radius, sector=sector):
+        cover[loc]=c
+    return cover
+
+class FOVPool(object):
+    """Calculates Fields of View of many observers of the same world on a pool of worker processes.
+
+    The occupancy grid is kept in shared memory, so it is written once per call rather than pickled once per observer."""
+    def __init__(self, width, height, processes=None):
+        self.width=width
+        self.height=height
+        self._grid=RawArray('b', width*height)
+        self._blocks=frombuffer(self._grid, dtype=int8).reshape((width,height))
+        self.processes=processes or cpu_count()
+        OffsetTable.get(width-1, height-1) #built before forking, so that the workers share its pages rather than each build one
+        self._pool=Pool(processes, _initWorker, (self._grid, width, height))
+
+    def calculateHexFOVs(self, world, observers, radius=None):
+        """Returns a list of width x height arrays of cover, one per (origin, fov, facing) observer, as for
+        FOV.coversToward.
+
+        world is a list of (x, y, blocksLOS) triples as for FOV.calculateHexFOV; fov of None or 2*pi means all around."""
+        self._setWorld(world)
+        tasks=[]
+        for (origin, fov, facing) in observers:
+            if fov is None or fov>=PI_2:
+                (fov,facing)=(None,None)
+            tasks.append((tuple(origin), fov, facing, radius))
+        return self._pool.map(_calculateCover, tasks)
+
+    def calculateHexFOV(self, world, origin, fov=None, facing=None, radius=None, sectors=None):
+        """Returns a width x height array of cover for a single observer, its sweep split into sectors angular sectors,
+        by default one per process, that are calculated in parallel and merged by maximum cover; see
+        FOV.calculateHexFOV for how closely that agrees with a single sweep."""
+        self._setWorld(world)
+        if fov is None or fov>=PI_2:
+            (fov,facing)=(None,None)
+        count=sectors or self.processes
+        covers=self._pool.map(_calculateSector, [(tuple(origin), fov, facing, radius, (k, count)) for k in xrange(count)])
+        return maximum.reduce(covers)
+
+    def _setWorld(self, world):
+        for (x,y,b) in world:
+            self._blocks[x,y]=bool(b)
+
+    def close(self):
+        """Shuts down the worker processes."""
+        self._pool.close()
+        self._pool.join()
+
+if __name__=='__main__':
+    import unittest
+    from random import Random
+
+    class FOVPoolTest(unittest.TestCase):
+        def test01_MatchesSerial(self):
+            random=Random(0)
+            (width,height)=(15,13)
+            world=[(i,j,random.random()<0.3) for i in xrange(width) for j in xrange(height)]
+            observers=[((random.randint(0,width-1),random.randint(0,height-1)),pi/1.5,(1,0)) for k in xrange(4)]
+            observers.extend([((random.randint(0,width-1),random.randint(0,height-1)),PI_2,None) for k in xrange(4)])
+            pool=FOVPool(width, height, 2)
+            try:
+                for radius in (None, 5):
+                    covers=pool.calculateHexFOVs(world, observers, radius)
+                    for ((origin,fov,facing),cover) in zip(observers,covers):
+                        if fov==PI_2:
+                            (fov,facing)=(None,None)
+                        me=(origin[0],origin[1],dict(((w[0],w[1]),w[2]) for w in world)[origin])
+                        for (loc,c,d_2) in FOV().calculateHexFOV(me, world, fov, facing, radius):
+                            self.assertEqual(cover[loc], c)
+            finally:
+                pool.close()
+
+        def test02_Sectors(self):
+            random=Random(1)
+            (width,height)=(21,17)
+            world=[(i,j,random.random()<0.2) for i in xrange(width) for j in xrange(height)]
+            blocks=dict(((w[0],w[1]),w[2]) for w in world)
+            pool=FOVPool(width, height, 2)
+            try:
+                for (origin,fov,facing,radius) in (((10,8),PI_2,None,None), ((3,4),pi/1.5,(1,1),None), ((15,2),None,None,6)):
+                    if fov==PI_2:
+                        (fov,facing)=(None,None)
+                    for sectors in (None, 3, 8):
+                        cover=pool.calculateHexFOV(world, origin, fov, facing, radius, sectors)
+                        for (loc,c,d_2) in FOV().calculateHexFOV((origin[0],origin[1],blocks[origin]), world, fov, facing, radius):
+                            self.assertEqual(cover[loc]<1, c<1)
+                            self.assertAlmostEqual(cover[loc], c, 1)
+            finally:
+                pool.close()
+
+    unittest.main()
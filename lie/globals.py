@@ -13,3 +13,4 @@ message_buffer_height = None
 grid_offset = None
 scale_horizontally = None
 savefile_location = None
+fov_processes = None
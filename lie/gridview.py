@@ -2,7 +2,7 @@
 # Licensed under the Open Software License version 3.0.
 
 import abc
-from numpy import array as ar
+from numpy import array as ar, argwhere, minimum
 import math
 import logging
 import pygame
@@ -94,6 +94,12 @@ class GridView(pygame.sprite.RenderUpdates):
     def draw(self):
         self.clear(self.viewport, globals.background)
         dirties=set(self.level.getDirtyLocations()).union(self.perception.getDirtyLocations())
+        light=None
+        if self.lighting is not None:
+            light=minimum(self.lighting.update(), MAX_COLOR)
+            if self._light is not None:
+                dirties.update([tuple(loc) for loc in argwhere((light!=self._light).any(axis=2)).tolist()])
+            self._light=light
         #dirties=[(i,j) for j in xrange(self.height) for i in xrange(self.width)]
         gray=globals.darkest_gray
         gray=ar((gray,gray,gray))
@@ -103,6 +109,8 @@ class GridView(pygame.sprite.RenderUpdates):
         for loc in dirties:
             if self.perception[loc].cover==1.0:
                 self[loc].hue=copy(gray)
+            elif light is not None:
+                self[loc].hue=light[loc].copy()
             else:
                 self[loc].hue=copy(white)
                 #obj = self.perception[loc].top().obj if self.perception[loc].top() else None
@@ -148,9 +156,13 @@ class GridView(pygame.sprite.RenderUpdates):
         self.add(sprites)
 
 class HexGridView(GridView, Grid):
-    def __init__(self,level,perception,center=None):
+    def __init__(self,level,perception,center=None,lighting=None):
+        """If lighting, a LightMap of level, is given, the tiles in view are tinted by the light falling on them rather
+        than drawn in white."""
         self.level=level
         self.perception=perception
+        self.lighting=lighting
+        self._light=None
         (width,height)=(level.width,level.height)
         #viewable_area=Rect((0,globals.grid_offset),(min(width*globals.cell_width*(1.0+globals.scale_horizontally*0.75),globals.screen.get_width()),min(height*globals.cell_height,globals.screen.get_height()-globals.grid_offset)))
         viewable_area=Rect((0,globals.grid_offset),(globals.screen.get_width(),globals.screen.get_height()-globals.grid_offset))
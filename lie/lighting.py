@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# Copyright (c) 2012 Igor Kaplounenko.
+# Licensed under the Open Software License version 3.0.
+
+from numpy import array as ar, zeros, empty, sqrt, maximum, newaxis
+from math import sqrt as sqrt_
+import logging
+
+from asp_spa import FOV
+
+__all__=['LightSource', 'LightMap']
+
+logger=logging.getLogger(__name__)
+
+class LightSource(object):
+    """A source of light with the given intensity at its own tile, fading linearly with distance to nothing just past
+    radius, and tinted by hue.  A torch stays at loc, while a lantern, or anything else carried by or glowing from an
+    actor, follows its carrier from tile to tile."""
+    def __init__(self, radius, intensity=1.0, hue=(1.0,1.0,1.0), loc=None, carrier=None):
+        self.radius=radius
+        self.intensity=intensity
+        self.hue=ar(hue)
+        self._loc=loc
+        self.carrier=carrier
+
+    def getLoc(self):
+        if self.carrier is not None:
+            return tuple(self.carrier.parent.loc)
+        return self._loc
+
+    def setLoc(self, val):
+        self._loc=val
+
+    loc=property(getLoc, setLoc)
+
+    def isStatic(self):
+        """Whether the light stays put, so that its contribution is worth keeping."""
+        return self.carrier is None
+
+class _Contribution(object):
+    """The light one LightSource casts on the window of tiles within its reach, along with what it was computed from."""
+    __slots__=['loc', 'radius', 'window', 'blocks', 'lit', 'intensity', 'hue']
+
+class LightMap(object):
+    """The light falling on each tile of a level, as a width x height x 3 array of colors.
+
+    Each LightSource runs a FOV sweep bounded by its radius over the window of tiles it can reach, and the cover found
+    dims its light.  The light cast is kept, and only swept again once the light has moved, or a tile in its window
+    started or stopped blocking line of sight, which is only looked for when the level's revision changes, so a light
+    that has not moved or changed costs next to nothing.  The sum of the static lights is kept as well, so that only
+    moving lights cost anything from one turn to the next."""
+    def __init__(self, level, ambient=0.0):
+        self.level=level
+        self.ambient=ambient
+        self.lights=[]
+        self.map=None
+        self.fov=FOV()
+        self._blocks=None
+        self._revision=None
+        self._contributions={}
+        self._static=None #the sum of the static lights, or None if it has to be added up again
+
+    def __getstate__(self):
+        state=dict(self.__dict__)
+        state['_contributions']={}
+        state['_static']=None
+        state['_blocks']=None
+        state['_revision']=None
+        return state
+
+    def add(self, light):
+        self.lights.append(light)
+        if light.isStatic():
+            self._static=None
+
+    def remove(self, light):
+        self.lights.remove(light)
+        self._contributions.pop(light, None)
+        if light.isStatic():
+            self._static=None
+
+    def update(self):
+        """Brings map up to date with the lights and the level, and returns it."""
+        level=self.level
+        revised=self._revision!=level.revision
+        if revised:
+            self._blocks=ar([[bool(level[i,j].blocksLOS()) for j in xrange(level.height)] for i in xrange(level.width)])
+            self._revision=level.revision
+        moving=[]
+        for light in self.lights:
+            if self._refresh(light, revised) and light.isStatic():
+                self._static=None
+            if not light.isStatic():
+                moving.append(light)
+        if self._static is None:
+            self._static=zeros((level.width, level.height, 3))+self.ambient
+            for light in self.lights:
+                if light.isStatic():
+                    self._add(self._static, self._contributions[light])
+        light_map=self._static.copy()
+        for light in moving:
+            self._add(light_map, self._contributions[light])
+        self.map=light_map
+        return light_map
+
+    def _add(self, light_map, c):
+        (x0,x1,y0,y1)=c.window
+        light_map[x0:x1,y0:y1]+=c.lit[:,:,newaxis]*(c.intensity*c.hue)
+
+    def _refresh(self, light, revised):
+        """Sweeps light again if it moved, changed, or the tiles it reaches did, and returns whether its contribution
+        changed.  The tiles it reaches are only compared if revised, i.e. the level's revision changed."""
+        (loc, radius)=(light.loc, light.radius)
+        c=self._contributions.get(light)
+        if c is not None and (c.loc, c.radius)==(loc, radius):
+            (x0,x1,y0,y1)=c.window
+            if not revised or (c.blocks==self._blocks[x0:x1,y0:y1]).all():
+                if c.intensity==light.intensity and (c.hue==light.hue).all():
+                    return False
+                (c.intensity, c.hue)=(light.intensity, light.hue.copy())
+                return True
+        self._contributions[light]=self._sweep(light, loc, radius)
+        return True
+
+    def _sweep(self, light, loc, radius):
+        """Returns the _Contribution of light at loc, from a sweep over the tiles no further than radius away.
+
+        The window extends 2/sqrt(3) times radius along either axis, since a hex offset (dx,dy) is sqrt(dx*dx+dy*dy-dx*dy)
+        away."""
+        reach=int(2*radius/sqrt_(3))
+        (width, height)=(self.level.width, self.level.height)
+        (x0,x1,y0,y1)=(max(0,loc[0]-reach), min(width,loc[0]+reach+1), max(0,loc[1]-reach), min(height,loc[1]+reach+1))
+        blocks=self._blocks[x0:x1,y0:y1]
+        rows=blocks.tolist()
+        world=[(i,j,rows[i][j]) for i in xrange(x1-x0) for j in xrange(y1-y0)]
+        (x,y)=(loc[0]-x0,loc[1]-y0)
+        (cover, d_2)=self.fov.calculateHexFOV((x,y,rows[x][y]), world, radius=radius, out=(empty(blocks.shape), empty(blocks.shape, dtype=int)))
+        c=_Contribution()
+        (c.loc, c.radius, c.window, c.blocks)=(loc, radius, (x0,x1,y0,y1), blocks.copy())
+        c.lit=(1.0-cover)*maximum(0.0, 1.0-sqrt(d_2)/(radius+1.0))
+        (c.intensity, c.hue)=(light.intensity, light.hue.copy())
+        return c
+
+if __name__=='__main__':
+    import unittest
+    from reality import Level
+    from objects import Wall
+
+    class LightMapTest(unittest.TestCase):
+        def setUp(self):
+            self.level=Level(20,15)
+            for j in xrange(15):
+                if j!=7:
+                    self.level[10,j].terrain=Wall()
+            self.lighting=LightMap(self.level)
+
+        def test01_Shadow(self):
+            torch=LightSource(6, hue=(1.0,0.5,0.0), loc=(5,7))
+            self.lighting.add(torch)
+            light=self.lighting.update()
+            self.assertEqual(light[5,7].tolist(), [1.0,0.5,0.0])
+            self.assertTrue(light[7,7,0]>light[8,7,0]>0)
+            self.assertEqual(light[11,10].tolist(), [0.0,0.0,0.0]) #behind the wall
+            self.assertTrue(light[11,7,0]>0) #through the gap
+            self.assertEqual(light[5,14].tolist(), [0.0,0.0,0.0]) #beyond radius
+            self.assertEqual(light[:,:,2].max(), 0.0)
+
+        def test02_StaticCache(self):
+            torch=LightSource(6, loc=(5,7))
+            far=LightSource(3, loc=(16,2))
+            for light in (torch, far):
+                self.lighting.add(light)
+            before=self.lighting.update().copy()
+            (lit, static)=(dict(self.lighting._contributions), self.lighting._static)
+            self.level[16,14].terrain=Wall() #out of either torch's reach
+            self.lighting.update()
+            self.assertTrue(self.lighting._static is static)
+            for light in (torch, far):
+                self.assertTrue(self.lighting._contributions[light] is lit[light])
+            self.level[10,7].terrain=Wall()
+            after=self.lighting.update()
+            self.assertFalse(self.lighting._contributions[torch] is lit[torch])
+            self.assertTrue(self.lighting._contributions[far] is lit[far])
+            self.assertEqual(after[11,7].tolist(), [0.0,0.0,0.0])
+            self.assertEqual(after[13:,:6].tolist(), before[13:,:6].tolist())
+            torch.hue[1]=0.0 #changed in place
+            light=self.lighting.update()
+            self.assertEqual(light[5,7].tolist(), [1.0,0.0,1.0])
+            self.assertTrue(self.lighting._contributions[far] is lit[far])
+
+        def test03_Moving(self):
+            class Carrier(object):
+                pass
+            actor=Carrier()
+            actor.parent=self.level[3,3]
+            lantern=LightSource(4, carrier=actor)
+            torch=LightSource(6, loc=(14,7))
+            for light in (lantern, torch):
+                self.lighting.add(light)
+            self.lighting.update()
+            static=self.lighting._static
+            actor.parent=self.level[4,4]
+            light=self.lighting.update()
+            self.assertTrue(self.lighting._static is static)
+            self.assertEqual(light[4,4,0], 1.0)
+            self.assertEqual(light[14,7,0], 1.0)
+            self.assertTrue(light[3,3,0]<1.0)
+
+    unittest.main()
@@ -7,6 +7,8 @@ from asp_spa import FOV
 from reality import Grid
 from objects import Actor
 from math import pi, sin
+from collections import OrderedDict
+import numpy
 
 logger=logging.getLogger(__name__)
 
@@ -64,36 +66,146 @@ class PTile(object):
         self.memory = Memory(self.tile.top())
         return self.memory
 
+class FOVCache(object):
+    """A least recently used cache of Field of View results, counting its hits and misses."""
+    def __init__(self, capacity):
+        self.capacity=capacity
+        self.hits=0
+        self.misses=0
+        self._results=OrderedDict()
+
+    def get(self, key):
+        """Returns the result stored under key, or None."""
+        try:
+            result=self._results.pop(key)
+        except KeyError:
+            self.misses+=1
+            return None
+        self._results[key]=result
+        self.hits+=1
+        return result
+
+    def put(self, key, result):
+        """Stores a result, evicting the least recently used one if over capacity."""
+        self._results[key]=result
+        if len(self._results)>self.capacity:
+            self._results.popitem(last=False)
+
 class PGrid(Grid):
-    def __init__(self, grid, actor):
+    def __init__(self, grid, actor, cache_size=16, approximate=False):
+        """If approximate is set, Fields of View are calculated by FOV's approximate mode, e.g. for observers whose view
+        matters less than the player's."""
         super(PGrid, self).__init__(grid.width, grid.height)
         self.grid=[[PTile(grid[i,j]) for j in xrange(grid.height)] for i in xrange(grid.width)]
-        self.fov=FOV()
+        self._level=grid
+        self.fov=FOV(incremental=not approximate, approximate=approximate)
+        self.cache=FOVCache(cache_size) #keyed by (location, fov, facing, radius, level revision)
+        self._cover=numpy.ones((grid.width, grid.height)) #the cover and d2 PTiles were last given, to tell which changed
+        self._d2=numpy.zeros((grid.width, grid.height), dtype=int)
+        self._world=None
         self.actor=actor
         self.target=None
         self.monsters={}
 
+    def __getstate__(self):
+        state=dict(self.__dict__)
+        state['cache']=FOVCache(self.cache.capacity)
+        state['_cover']=None
+        state['_d2']=None
+        state['_world']=None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'cache' not in state: #saved before PGrid cached its Fields of View
+            self._level=None
+            self.cache=FOVCache(16)
+            (self._cover, self._d2, self._world)=(None, None, None)
+
+    def getLevel(self):
+        if self._level is None: #saved before PGrid kept its level, which its tiles only know once that has loaded too
+            self._level=self.grid[0][0].tile.level
+        return self._level
+
+    level=property(getLevel, None)
+
     def calculateFOV(self, radius=None):
         loc=self.actor.parent.loc
         tile=self[loc[0],loc[1]].tile
         me=(loc[0],loc[1],tile.blocksLOS())
-        world=[(i,j,self[i,j].tile.blocksLOS()) for i in xrange(self.width) for j in xrange(self.height)]
-        fov=self.actor.getFOV()
+        (fov,facing)=(self.actor.getFOV(),self.actor.facing)
         if fov==PI_2:
-            ret=self.fov.calculateHexFOV(me,world)
-        else:
-            ret=self.fov.calculateHexFOV(me, world, fov, self.actor.facing)
-        for r in ret:
-            self[r[0][0],r[0][1]].d2=r[2]
-            if r[1]>1:
-                logger.error(str(me))
-                logger.error(str(r))
-                raise AssertionError("cover > 1")
-            self[r[0][0],r[0][1]].cover=sin(r[1]*pi/2)
-        self.monsters=dict([(tile.tile.loc,tile.top()) for tile in self.tiles if tile.cover<1 and isinstance(tile.top(), Actor) and tile.top()!=self.actor])
+            (fov,facing)=(None,None)
+        key=((loc[0],loc[1]), fov, facing, radius, self.level.revision)
+        ret=self.cache.get(key)
+        if ret is None:
+            world=self._getWorld()
+            ret=(numpy.empty((self.width, self.height)), numpy.empty((self.width, self.height), dtype=int))
+            if self.fov.isCurrent(me, fov, facing, radius):
+                self.fov.updateHexFOV([w for (w,previous) in zip(world,self._world) if bool(w[2])!=bool(previous[2])], self.level.exposed, ret)
+            else:
+                self.fov.calculateHexFOV(me, world, fov, facing, radius, self.level.exposed, out=ret)
+            self._world=world
+            self.cache.put(key, ret)
+        self._applyFOV(me, ret[0], ret[1])
+
+    def coversToward(self, loc, actors, radius=None):
+        """Returns a dict of the cover, as PTile.cover would hold it, that each of actors has toward the tile at loc; see
+        FOV.coversToward."""
+        target=(loc[0],loc[1],self[loc[0],loc[1]].tile.blocksLOS())
+        covers=self.fov.coversToward(target, self._getWorld(), self._getObservers(actors), radius, self.level.exposed)
+        return dict([(actor, sin(cover*pi/2)) for (actor,cover) in zip(actors,covers)])
+
+    def coverMatrix(self, actors, radius=None):
+        """Returns an N x N array of the cover, as PTile.cover would hold it, that actors[j] has from actors[i] at [i,j];
+        see FOV.coverMatrix."""
+        covers=self.fov.coverMatrix(self._getWorld(), self._getObservers(actors), radius, self.level.exposed)
+        return numpy.sin(covers*pi/2)
+
+    def _getWorld(self):
+        return [(i,j,self[i,j].tile.blocksLOS()) for i in xrange(self.width) for j in xrange(self.height)]
+
+    def _getObservers(self, actors):
+        observers=[]
+        for actor in actors:
+            (fov,facing)=(actor.getFOV(),actor.facing)
+            if fov==PI_2:
+                (fov,facing)=(None,None)
+            observers.append((actor.parent.loc, fov, facing))
+        return observers
+
+    def applyCover(self, cover):
+        """Applies a width x height array of FOV cover calculated elsewhere, e.g. by FOVPool."""
+        loc=self.actor.parent.loc
+        me=(loc[0],loc[1],self[loc[0],loc[1]].tile.blocksLOS())
+        (i,j)=numpy.indices((self.width, self.height))
+        (dx,dy)=(i-me[0],j-me[1])
+        self._applyFOV(me, cover, dx*dx+dy*dy-dx*dy)
+
+    def _applyFOV(self, me, cover, d2):
+        """Applies width x height arrays of FOV cover and d2, only touching the PTiles whose cover or d2 changed."""
+        if (cover>1).any():
+            logger.error(str(me))
+            logger.error(str(numpy.argwhere(cover>1).tolist()))
+            raise AssertionError("cover > 1")
+        cover=numpy.sin(cover*pi/2)
+        if self._cover is None: #dropped on saving, so compare against what the PTiles hold
+            self._cover=numpy.array([[tile.cover for tile in column] for column in self.grid])
+            self._d2=numpy.array([[tile.d2 for tile in column] for column in self.grid], dtype=int)
+        for (i,j) in numpy.argwhere((cover!=self._cover)|(d2!=self._d2)).tolist():
+            tile=self.grid[i][j]
+            tile.d2=d2.item(i,j)
+            tile.cover=cover.item(i,j)
+        (self._cover, self._d2)=(cover, d2)
+        self.monsters={}
+        for (i,j) in numpy.argwhere(cover<1).tolist():
+            top=self.grid[i][j].top()
+            if isinstance(top, Actor) and top!=self.actor:
+                self.monsters[i,j]=top
         visible_actors=set(self.monsters.values())
-        for tile in self.tiles:
-            if tile.cover==1 and tile.memory and tile.memory.obj in visible_actors:
+        for (i,j) in numpy.argwhere(cover==1).tolist():
+            tile=self.grid[i][j]
+            if tile.memory and tile.memory.obj in visible_actors:
                 tile.memory = Memory(tile.tile.terrain)
         self.monsters_keys=sorted(self.monsters.keys(), key=lambda x: pow(x[0]-me[0],2)+pow(x[1]-me[1],2)-(x[0]-me[0])*(x[1]-me[1]))
         logger.debug('me:'+str(self.actor.parent.loc)+' them:'+str(self.monsters_keys))
@@ -111,3 +223,86 @@ class PGrid(Grid):
         else:
             objects=self[loc].tile.contents()
         return [(id(obj), obj.getShortDescription(self[loc].cover), obj.getLongDescription(self[loc].cover)) for obj in objects]
+
+if __name__=='__main__':
+    import unittest
+    import cPickle
+    from reality import Level
+    from objects import Wall, Floor
+
+    class Observer(Actor):
+        def __init__(self):
+            super(Observer, self).__init__()
+
+        def moveBlocked(self, tile):
+            pass
+
+        def moveToLocation(self, loc):
+            pass
+
+    class PerceptionTest(unittest.TestCase):
+        def test01_Cache(self):
+            cache=FOVCache(2)
+            self.assertTrue(cache.get('a') is None)
+            cache.put('a', 1)
+            cache.put('b', 2)
+            self.assertEqual(cache.get('a'), 1)
+            cache.put('c', 3) #evicts b, the least recently used
+            self.assertTrue(cache.get('b') is None)
+            self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+            self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+        def test02_CalculateFOV(self):
+            level=Level(9,9)
+            actor=Observer()
+            level[4,4].actor=actor
+            actor.parent=level[4,4]
+            perception=PGrid(level, actor)
+            perception.calculateFOV()
+            self.assertEqual((perception.cache.hits, perception.cache.misses), (0, 1))
+            self.assertEqual(perception[7,4].cover, 0)
+            perception.calculateFOV()
+            self.assertEqual((perception.cache.hits, perception.cache.misses), (1, 1))
+            level[5,4].terrain=Wall()
+            perception.calculateFOV()
+            self.assertEqual((perception.cache.hits, perception.cache.misses), (1, 2))
+            self.assertEqual(perception[7,4].cover, 1)
+
+        def test03_Pickle(self):
+            level=Level(9,9)
+            actor=Observer()
+            level[4,4].actor=actor
+            actor.parent=level[4,4]
+            perception=PGrid(level, actor)
+            perception.calculateFOV()
+            loaded=cPickle.loads(cPickle.dumps(perception, 2))
+            self.assertEqual((len(loaded.cache._results), loaded.cache.capacity), (0, 16))
+            self.assertEqual((loaded._world, loaded._cover, loaded._d2), (None, None, None))
+            loaded.level[5,4].terrain=Wall()
+            loaded.calculateFOV()
+            self.assertEqual(loaded[7,4].cover, 1)
+
+        def test04_OldSave(self):
+            level=Level(9,9)
+            actor=Observer()
+            level[4,4].actor=actor
+            actor.parent=level[4,4]
+            level[5,4].terrain=Wall()
+            perception=PGrid(level, actor)
+            perception.calculateFOV()
+            del level.revision, level.exposed
+            for tile in level.tiles:
+                del tile.level
+            state=dict([(key,value) for (key,value) in perception.__dict__.items() if key not in ('_level','cache','_cover','_d2','_world')])
+            state['fov']=FOV.__new__(FOV)
+            (level, state)=cPickle.loads(cPickle.dumps((level, state), 2))
+            loaded=PGrid.__new__(PGrid)
+            loaded.__setstate__(state)
+            self.assertTrue(loaded.level is level)
+            self.assertEqual((level.revision, level.exposed), (0, set([(5,4)])))
+            level[5,4].terrain=Floor()
+            self.assertEqual((level.revision, level.exposed), (1, set()))
+            loaded.calculateFOV()
+            self.assertEqual(loaded[7,4].cover, 0)
+
+    unittest.main()
@@ -11,15 +11,20 @@ SQUARE_NEIGHBORS=((1,1),(1,0),(1,-1),(0,-1),(-1,-1),(-1,0),(-1,1),(0,1))
 
 class Tile(object):
     """A tile containing actual game objects.  Floor implied."""
-    def __init__(self, loc):
+    def __init__(self, loc, level=None):
         super(Tile, self).__init__()
         self._actor=None
         self._terrain=None
         self.items=None
         self.loc=loc
+        self.level=level
         self.setTerrain(Floor())
         self.dirty=1
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('level', None) #saved before tiles knew their level, which sets it once it has loaded
+
     def blocksLOS(self):
         return (self.terrain and self.terrain.blocks_los) or (self.actor and self.actor.blocks_los)
     
@@ -27,8 +32,10 @@ class Tile(object):
         if val:
             assert(isinstance(val,Actor))
             assert(self.isPassableBy(val))
+        blocked=self.blocksLOS()
         self._actor=val
         self.dirty=1
+        self._touch(blocked)
     
     def getActor(self):
         return self._actor
@@ -38,8 +45,10 @@ class Tile(object):
     def setTerrain(self,val):
         assert(isinstance(val,Terrain))
         if(self.actor is None or val.isPassableBy(self.actor)):
+            blocked=self.blocksLOS()
             self._terrain=val
             self.dirty=1
+            self._touch(blocked)
         else:
             raise 'Attempted to set terrain to a non-passable type while an actor was present.'
     
@@ -48,6 +57,12 @@ class Tile(object):
 
     terrain=property(getTerrain, setTerrain)
 
+    def _touch(self, blocked):
+        """Bumps the level's revision and updates its exposed walls if whether this tile blocks line of sight changed."""
+        if self.level is not None and bool(blocked)!=bool(self.blocksLOS()):
+            self.level.revision+=1
+            self.level.updateExposed(self.loc)
+
     def top(self):
         if self.actor:
             return self.actor
@@ -110,11 +125,92 @@ class Grid(object):
         return neighbors
     
 class Level(Grid):
-    """A world level containing tiles."""
+    """A world level containing tiles.
+
+    revision is incremented whenever a tile starts or stops blocking line of sight, so that anything derived from line of
+    sight can tell whether it is still current.  exposed holds the locations of tiles that block line of sight but border
+    one that does not, or the edge of the level; the remaining blocking tiles are buried in rock and cannot cast a shadow
+    their neighbors do not."""
     def __init__(self,width,height):
         super(Level,self).__init__(width,height)
-        self.grid=[[Tile((i,j)) for j in xrange(self.height)] for i in xrange(self.width)]
+        self.revision=0
+        self.exposed=set()
+        self.grid=[[Tile((i,j), self) for j in xrange(self.height)] for i in xrange(self.width)]
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'revision' not in state: #saved before levels tracked line of sight
+            self.revision=0
+            for tile in self.tiles:
+                tile.level=self
+            self.exposed=set([tile.loc for tile in self.tiles if self.isExposed(tile.loc)])
+
+    def isExposed(self, loc):
+        """Whether the tile at loc blocks line of sight and has a neighbor, or the edge of the level, that does not."""
+        if not self[loc].blocksLOS():
+            return False
+        for n in self.neighbors:
+            (i,j)=(loc[0]+n[0],loc[1]+n[1])
+            if not (0<=i<self.width and 0<=j<self.height) or not self.grid[i][j].blocksLOS():
+                return True
+        return False
+
+    def updateExposed(self, loc):
+        """Updates exposed for the tile at loc and its neighbors, after it started or stopped blocking line of sight."""
+        for n in ((0,0),)+tuple(self.neighbors):
+            (i,j)=(loc[0]+n[0],loc[1]+n[1])
+            if 0<=i<self.width and 0<=j<self.height:
+                if self.isExposed((i,j)):
+                    self.exposed.add((i,j))
+                else:
+                    self.exposed.discard((i,j))
 
 class World(object):
     def __init__(self):
         raise NotImplementedError()
+
+if __name__=='__main__':
+    import unittest
+    import cPickle
+
+    class Statue(Actor):
+        def __init__(self):
+            super(Statue, self).__init__()
+            self.blocks_los=True
+
+        def moveBlocked(self, tile):
+            pass
+
+        def moveToLocation(self, loc):
+            pass
+
+    class LevelTest(unittest.TestCase):
+        def test01_Revision(self):
+            level=Level(5,5)
+            self.assertEqual((level.revision, level.exposed), (0, set()))
+            level[2,2].terrain=Wall()
+            self.assertEqual((level.revision, level.exposed), (1, set([(2,2)])))
+            level[2,2].terrain=Wall() #still blocking
+            level[1,1].terrain=Floor()
+            self.assertEqual(level.revision, 1)
+            level[2,2].terrain=Floor()
+            self.assertEqual((level.revision, level.exposed), (2, set()))
+            statue=Statue()
+            level[3,3].actor=statue
+            self.assertEqual((level.revision, level.exposed), (3, set([(3,3)])))
+            level[3,3].actor=None
+            self.assertEqual((level.revision, level.exposed), (4, set()))
+
+        def test02_OldSave(self):
+            level=Level(5,5)
+            level[2,2].terrain=Wall()
+            del level.revision, level.exposed
+            for tile in level.tiles:
+                del tile.level
+            level=cPickle.loads(cPickle.dumps(level, 2))
+            self.assertEqual((level.revision, level.exposed), (0, set([(2,2)])))
+            self.assertTrue(level[1,1].level is level)
+            level[2,2].terrain=Floor()
+            self.assertEqual((level.revision, level.exposed), (1, set()))
+
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# Copyright (c) 2012 Igor Kaplounenko.
+# Licensed under the Open Software License version 3.0.
+
+from numpy import array as ar, linspace, newaxis, absolute, sqrt
+import logging
+
+from asp_spa import Locus, RayPair
+
+__all__=['SamplingFOV']
+
+logger=logging.getLogger(__name__)
+
+class SamplingFOV(object):
+    """A brute-force Field of View calculator, kept as a reference for FOV to be checked against.
+
+    This is the sampling approach FOV.description started out with.  Tiles are discs of unit diameter, as they are to
+    FOV.  samples points are placed on the diameter of the observer's tile and on that of the target's, both
+    perpendicular to the line between them.  A target point is hidden if the segment from every observer point to it
+    passes within half a unit of the center of a nearer blocking tile.  The cover of the target is the fraction of its
+    points that are hidden.  That is the same umbra FOV casts from every blocking locus, but also of any group of them,
+    whereas FOV only merges the umbras of loci that touch, so the two differ most behind spaced out rows of blocking
+    tiles."""
+    def __init__(self, samples=9):
+        self.samples=samples
+
+    def calculateHexFOV(self, me, world, radius=None):
+        """Returns ((x,y), cover, d_2) for every (x,y,blocksLOS) triple of world, as FOV.calculateHexFOV does, without a
+        view cone."""
+        (x,y)=(me[0],me[1])
+        offsets=[(i[0]-x,i[1]-y) for i in world]
+        coords=ar([Locus.T.dot((dx,dy,1))[0:2] for (dx,dy) in offsets])
+        blocking=coords[ar([bool(i[2]) for i in world], dtype=bool)]
+        s=linspace(-0.5, 0.5, self.samples)
+        (observer, target)=(s[:,newaxis,newaxis], s[newaxis,:,newaxis]) #[observer point, target point, blocking tile]
+        ret=[]
+        for ((dx,dy),c,i) in zip(offsets, coords, world):
+            d_2=dx*dx+dy*dy-dx*dy
+            if not d_2:
+                ret.append(((i[0],i[1]), 0.0, 0)) #an object cannot provide cover for itself
+                continue
+            if radius is not None and d_2>radius*radius:
+                ret.append(((i[0],i[1]), 1.0, d_2))
+                continue
+            d=sqrt(d_2)
+            (ux,uy)=(c[0]/d, c[1]/d)
+            along=blocking[:,0]*ux+blocking[:,1]*uy #the position of the blocking tiles along, and across, the line of sight
+            across=blocking[:,0]*-uy+blocking[:,1]*ux
+            nearer=(along>0)&(along<d-RayPair.EPSILON)&(absolute(across)<1.0)
+            if not nearer.any():
+                ret.append(((i[0],i[1]), 0.0, d_2))
+                continue
+            (along, across)=(along[nearer][newaxis,newaxis,:], across[nearer][newaxis,newaxis,:])
+            lateral=target-observer
+            t=((along*d+(across-observer)*lateral)/(d_2+lateral*lateral)).clip(0.0, 1.0) #the point of each segment closest to each tile
+            (ta, tc)=(t*d-along, observer+t*lateral-across)
+            blocked=(ta*ta+tc*tc<=0.25+RayPair.EPSILON).any(axis=2)
+            ret.append(((i[0],i[1]), blocked.all(axis=0).mean(), d_2))
+        return ret
+
+if __name__=='__main__':
+    import os
+    from glob import glob
+    from random import Random
+    from sys import argv
+    from getopt import getopt, GetoptError
+    from timeit import default_timer
+    from asp_spa import FOV
+
+    def usage():
+        print "Usage: "
+        print ""
+        print '\t'+argv[0]+' -h|--help'
+        print '\t'+argv[0]+' [-s|--seeds <X>[-<Y>]] [-g|--geometry <W>x<H>] [-o|--observers <N>] [-n|--samples <N>] [-t|--tolerance <T>] [-d|--radius <R>] [-x|--exact] [-a|--approximate] [-v|--verbose]'
+        print ""
+        print "Compares FOV against SamplingFOV on CA caves and forests generated from each seed, and on the maps in maps/,"
+        print "from observers on random floor tiles, and reports the tiles whose cover differs by more than the tolerance."
+        print "FOV only approximates within a radius."
+
+    def compare(name, world, fov, observers, samples, tolerance, verbose, radius):
+        """Runs both calculators, up to radius, from observers random floor tiles of world, prints how far apart they are and returns
+        (tiles, tiles beyond tolerance, FOV time, SamplingFOV time)."""
+        random=Random(name)
+        floor=[(i[0],i[1]) for i in world if not i[2]]
+        reference=SamplingFOV(samples)
+        (tiles, beyond, total, worst, fov_time, reference_time)=(0, [], 0.0, (0.0, None, None), 0.0, 0.0)
+        for k in xrange(observers):
+            me=random.choice(floor)+(False,)
+            start=default_timer()
+            result=fov.calculateHexFOV(me, world, radius=radius)
+            fov_time+=default_timer()-start
+            start=default_timer()
+            expected=dict([(r[0], r[1]) for r in reference.calculateHexFOV(me, world, radius)])
+            reference_time+=default_timer()-start
+            for (loc, cover, d_2) in result:
+                difference=abs(cover-expected[loc])
+                tiles+=1
+                total+=difference
+                if difference>tolerance:
+                    beyond.append((difference, loc, me[0:2], cover, expected[loc]))
+                if difference>worst[0]:
+                    worst=(difference, loc, me[0:2])
+        print "%s: %d tiles, mean divergence %.4f, %d (%.2f%%) beyond %.2f, worst %.2f at %s from %s; FOV %.3fs, sampling %.3fs" % \
+                (name, tiles, total/tiles, len(beyond), 100.0*len(beyond)/tiles, tolerance, worst[0], worst[1], worst[2], fov_time, reference_time)
+        if verbose:
+            for (difference, loc, origin, cover, sampled) in sorted(beyond, reverse=True):
+                print "\t%s from %s: FOV %.3f sampling %.3f" % (loc, origin, cover, sampled)
+        return (tiles, len(beyond), fov_time, reference_time)
+
+    (seeds, geometry, observers, samples, tolerance, verbose, exact, approximate, radius)=((0,4), (25,25), 5, 9, 0.25, False, False, False, None)
+    try:
+        opts, args = getopt(argv[1:], "hs:g:o:n:t:d:xav", ['help','seeds=','geometry=','observers=','samples=','tolerance=','radius=','exact',
+            'approximate','verbose'])
+        for opt, arg in opts:
+            if opt in ('-h','--help'):
+                usage()
+                exit(0)
+            elif opt in ('-s','--seeds'):
+                seeds=arg.split('-') if '-' in arg else (arg,arg)
+            elif opt in ('-g','--geometry'):
+                geometry=tuple([int(g) for g in arg.split('x')])
+            elif opt in ('-o','--observers'):
+                observers=int(arg)
+            elif opt in ('-n','--samples'):
+                samples=int(arg)
+            elif opt in ('-t','--tolerance'):
+                tolerance=float(arg)
+            elif opt in ('-d','--radius'):
+                radius=int(arg)
+            elif opt in ('-x','--exact'):
+                exact=True
+            elif opt in ('-a','--approximate'):
+                approximate=True
+            elif opt in ('-v','--verbose'):
+                verbose=True
+    except (GetoptError, ValueError):
+        usage()
+        exit(1)
+    from mapgen import CellularAutomata
+    from objects import Floor, Wall
+
+    maps=[]
+    for seed in xrange(int(seeds[0]),int(seeds[1])+1):
+        level=CellularAutomata(Random(seed),Floor,Wall).generateLevel(geometry[0],geometry[1])
+        maps.append(('cave seed '+str(seed), [(i,j,bool(level[i,j].blocksLOS())) for i in xrange(level.width) for j in xrange(level.height)]))
+        random=Random(seed)
+        density=random.choice((0.05,0.1,0.2))
+        maps.append(('forest seed %d (%d%%)' % (seed, density*100), [(i,j,random.random()<density) for i in xrange(geometry[0]) for j in xrange(geometry[1])]))
+    for path in sorted(glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps', '*.txt'))):
+        rows=[line.rstrip('\n') for line in open(path) if line.strip()]
+        maps.append((os.path.basename(path)[:-len('.txt')], [(i,j,c=='#') for (j,row) in enumerate(rows) for (i,c) in enumerate(row)]))
+    fov=FOV(exact=exact, approximate=approximate)
+    totals=[0, 0, 0.0, 0.0]
+    for (name, world) in maps:
+        totals=[a+b for (a,b) in zip(totals, compare(name, world, fov, observers, samples, tolerance, verbose, radius))]
+    print "total: %d tiles, %d (%.2f%%) beyond %.2f; FOV %.3fs, sampling %.3fs" % \
+            (totals[0], totals[1], 100.0*totals[1]/totals[0], tolerance, totals[2], totals[3])
@@ -13,6 +13,7 @@ from lie import input_handling, messages,  turns, ui, savefile
 from lie.gridview import HexGridView
 from lie.mapgen import CellularAutomata
 from lie.perception import PGrid
+from lie.fovpool import FOVPool
 from lie.objects import *
 import lie.globals
 from lie.context import Context as Context
@@ -104,8 +105,12 @@ def player_post():
 
 def enemies_phase():
     ctx=Context.getContext()
+    if ctx.fov_pool:
+        world=[(tile.loc[0],tile.loc[1],tile.blocksLOS()) for tile in ctx.world.tiles]
+        covers=ctx.fov_pool.calculateHexFOVs(world, [(enemy.parent.loc, enemy.getFOV(), enemy.facing) for enemy in ctx.enemies])
+        for (enemy,cover) in zip(ctx.enemies,covers):
+            enemy.perception.applyCover(cover)
     for enemy in ctx.enemies:
-        #enemy.perception.calculateFOV()
         enemy.act()
     return True
 
@@ -209,6 +214,9 @@ if __name__ == '__main__':
     else:
         for tile in ctx.world.tiles:
             tile.dirty=1
+    ctx.fov_pool=None
+    if lie.globals.fov_processes:
+        ctx.fov_pool=FOVPool(ctx.world.width, ctx.world.height, lie.globals.fov_processes)
     ctx.worldview=HexGridView(ctx.world, ctx.pc.perception)
     ctx.worldview.center(ctx.worldview[ctx.pc.parent.loc].rect)
     ctx.screen_manager.current.view.add(ctx.worldview)